@@ -0,0 +1,213 @@
+# Benchmark of every server-side callback of the dashboards.
+#
+# Each app module is imported and every callback registered on its `app` is called directly (without the Flask
+# request) over a grid of inputs derived from the layout: every option of the single-select dropdowns, every mark of
+# the sliders, 1, 10 and all options of the multi-select dropdowns, and clicks on a sample of countries for the maps.
+# For each callback the latency percentiles, the memory allocated per call and the size of the serialized output are
+# written to a JSON file, so that runs on two commits can be compared:
+#
+#   python benchmarks/callback_bench.py                              # writes benchmarks/results/callbacks-<commit>.json
+#   python benchmarks/callback_bench.py --apps sanitation_map --compare benchmarks/results/callbacks-<other>.json
+import argparse
+import importlib
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# Neither warm the response cache nor log the benchmarked requests as selections of visitors, see `warmup.py`
+os.environ.update({"DASH_WARMUP": "0", "DASH_WARMUP_LOG": "0"})
+
+from dash import dcc  # noqa: E402
+from dash._callback import NoUpdate  # noqa: E402
+from dash.exceptions import PreventUpdate  # noqa: E402
+from plotly.io.json import to_json_plotly  # noqa: E402
+
+APPS = ["intern_sanitation", "sanitation_map", "diarrhoea_cleaning", "indicator_explorer", "who_comparison",
+        "human_sanitation", "stack_barchart", "stack_barchart2", "sanitation_pie_chart", "sanitation_pie_chart2"]
+
+# Countries clicked on the maps of each app, as `clickData` carries them
+CLICK_COUNTRIES = {
+    "sanitation_map": lambda module: module.datasets["drinking"]["Country"],
+    "diarrhoea_cleaning": lambda module: module.df["Entity"],
+}
+
+# Number of countries clicked, and the most input combinations called for one callback
+CLICKS = 10
+MAX_COMBINATIONS = 300
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def option_values(options):
+    if isinstance(options, dict):
+        return list(options)
+    return [option["value"] if isinstance(option, dict) else option for option in options or []]
+
+
+def evenly(values, count):
+    values = list(values)
+    if len(values) <= count:
+        return values
+    return [values[i] for i in np.linspace(0, len(values) - 1, count).round().astype(int)]
+
+
+# Values of one input or state of a callback to benchmark
+def input_values(module, component, prop):
+    if component is None:
+        return [None]
+    current = getattr(component, prop, None)
+
+    if prop == "value" and isinstance(component, dcc.Dropdown):
+        options = option_values(component.options)
+        if getattr(component, "multi", False):
+            return [options[:1], options[:10], options]
+        return options
+    if prop == "value" and isinstance(component, (dcc.RadioItems,)):
+        return option_values(component.options)
+    if prop == "value" and isinstance(component, dcc.Checklist):
+        return [[], option_values(component.options)]
+    if prop == "value" and isinstance(component, (dcc.Slider, dcc.RangeSlider)):
+        if component.marks:
+            return [int(mark) if str(mark).lstrip("-").isdigit() else mark for mark in component.marks]
+        return [current]
+    if prop == "n_clicks":
+        return [1]
+    if prop == "clickData" and module.__name__ in CLICK_COUNTRIES:
+        countries = evenly(sorted(set(CLICK_COUNTRIES[module.__name__](module).dropna())), CLICKS)
+        return [None] + [{"points": [{"location": country, "hovertext": country, "customdata": [country]}]}
+                         for country in countries]
+    return [current]
+
+
+def input_grid(module, callback):
+    components = {component.id: component for component in module.app.layout._traverse()
+                  if getattr(component, "id", None) is not None}
+    arguments = callback["inputs"] + callback["state"]
+    values = [input_values(module, components.get(argument["id"]), argument["property"]) for argument in arguments]
+    combinations = list(itertools.product(*values))
+    return [f"{argument['id']}.{argument['property']}" for argument in arguments], evenly(combinations, MAX_COMBINATIONS)
+
+
+def serialized_size(output):
+    if isinstance(output, NoUpdate):
+        return 0
+    if isinstance(output, (list, tuple)):
+        return sum(serialized_size(item) for item in output)
+    return len(to_json_plotly(output))
+
+
+def percentiles(samples):
+    return {f"p{q}": round(float(np.percentile(samples, q)), 3) for q in (50, 95, 99)} if samples else {}
+
+
+def bench_callback(func, grid, repeat):
+    latencies, sizes, errors = [], [], 0
+    for _ in range(repeat):
+        for args in grid:
+            start = time.perf_counter()
+            try:
+                output = func(*args)
+            except PreventUpdate:
+                output = None
+            except Exception:  # noqa: BLE001 - a failing input is reported, not fatal for the whole run
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1e3)
+            if len(sizes) < len(grid):
+                sizes.append(serialized_size(output))
+
+    # Allocations in a separate pass, tracing slows the calls down
+    peaks, allocated = [], []
+    tracemalloc.start()
+    for args in grid:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            func(*args)
+        except Exception:  # noqa: BLE001
+            continue
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+        allocated.append(current - before)
+    tracemalloc.stop()
+
+    return {
+        "calls": len(latencies),
+        "errors": errors,
+        "latency_ms": percentiles(latencies),
+        "peak_alloc_bytes": percentiles(peaks),
+        "retained_bytes": percentiles(allocated),
+        "output_bytes": percentiles(sizes),
+    }
+
+
+def bench_app(name, repeat):
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    import_seconds = time.perf_counter() - start
+
+    callbacks = {}
+    for key, callback in module.app.callback_map.items():
+        if "callback" not in callback:
+            # Clientside callback, runs in the browser
+            continue
+        func = callback["callback"].__wrapped__
+        names, grid = input_grid(module, callback)
+        callbacks[key] = {"function": func.__name__, "inputs": names, "combinations": len(grid),
+                          **bench_callback(func, grid, repeat)}
+        print(f"{name:<22}{key[:60]:<62}{callbacks[key]['latency_ms'].get('p50', float('nan')):>9.2f}"
+              f"{callbacks[key]['latency_ms'].get('p95', float('nan')):>9.2f}"
+              f"{callbacks[key]['output_bytes'].get('p50', 0):>12.0f}")
+    return {"import_seconds": round(import_seconds, 3), "callbacks": callbacks}
+
+
+def compare(results, baseline):
+    print(f"\n{'callback':<84}{'p50 before':>11}{'p50 now':>9}{'change':>9}")
+    for app_name, app_results in results["apps"].items():
+        before_callbacks = baseline.get("apps", {}).get(app_name, {}).get("callbacks", {})
+        for key, stats in app_results["callbacks"].items():
+            before = before_callbacks.get(key, {}).get("latency_ms", {}).get("p50")
+            now = stats["latency_ms"].get("p50")
+            if before and now:
+                print(f"{(app_name + ' ' + key)[:83]:<84}{before:>11.2f}{now:>9.2f}{(now / before - 1) * 100:>8.0f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the callbacks of the dashboards")
+    parser.add_argument("--apps", nargs="+", default=APPS, choices=APPS)
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the input grid of each callback")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/callbacks-<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare the median latencies with")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    print(f"{'app':<22}{'callback':<62}{'p50 ms':>9}{'p95 ms':>9}{'bytes p50':>12}")
+    results = {"commit": commit, "python": platform.python_version(), "repeat": args.repeat,
+               "apps": {name: bench_app(name, args.repeat) for name in args.apps}}
+
+    output = args.output or os.path.join("benchmarks", "results", f"callbacks-{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
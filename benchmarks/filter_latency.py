@@ -0,0 +1,40 @@
+# Micro-benchmark of the row filtering done by the `intern_sanitation.py` callbacks: the original
+# `isin` + `sort_values` + residence mask against a lookup in the precomputed `SliceIndex`.
+#
+# Run from anywhere with: python benchmarks/filter_latency.py
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from sanitation_data import SliceIndex, load_who_datasets  # noqa: E402
+
+
+# The filtering that every figure callback did before the index existed
+def scan_filter(df, countries, residence_type):
+    dff = df[df["Country"].isin(countries)]
+    dff = dff.sort_values(by="Year")
+    return dff[dff["Residence Area Type"] == residence_type]
+
+
+def index_filter(index, countries, residence_type):
+    return index.rows(countries, residence_type)
+
+
+def best_of(func, *args, repeat=7, number=50):
+    return min(timeit.repeat(lambda: func(*args), repeat=repeat, number=number)) / number
+
+
+if __name__ == "__main__":
+    datasets = load_who_datasets()
+    print(f"{'dataset':<16}{'countries':>10}{'scan (ms)':>12}{'index (ms)':>12}{'speedup':>10}")
+    for name, df in datasets.items():
+        index = SliceIndex(df)
+        all_countries = list(df["Country"].unique())
+        for label, countries in [("1", ["Kenya"]), ("10", all_countries[:10]), ("all", all_countries)]:
+            scan = best_of(scan_filter, df, countries, "Total")
+            indexed = best_of(index_filter, index, countries, "Total")
+            print(f"{name:<16}{label:>10}{scan * 1e3:>12.3f}{indexed * 1e3:>12.3f}{scan / indexed:>9.1f}x")
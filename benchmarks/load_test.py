@@ -0,0 +1,255 @@
+# Load test of the `_dash-update-component` endpoint of the dashboards.
+#
+# A scenario replays the requests the browser sends for a realistic sequence of interactions, e.g. scrubbing the year
+# slider of `sanitation_map.py` or clicking countries on the map of `diarrhoea_cleaning.py`. Each interaction is the
+# set of callback requests one user action triggers; its latency is the time until all of them have answered.
+#
+# Clients run in threads, against either
+# - the Flask test client of the app in this process (`--mode client`, no network and no gunicorn), or
+# - a local gunicorn started for every `--workers`/`--threads` configuration (`--mode gunicorn`)
+# and every `--concurrency` level, giving a throughput and latency curve per server configuration:
+#
+#   python benchmarks/load_test.py diarrhoea_map_clicks --mode gunicorn --workers 1 2 4 --threads 1 4 --concurrency 1 4 16
+#
+# `--cold` disables the response cache of `compression.py`, so that every request runs its callback.
+# `sanitation_map.py` draws the map in the browser unless started with SANITATION_MAP_CLIENTSIDE=0.
+import argparse
+import http.client
+import importlib
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# Environment of the apps imported here and of the gunicorns started here: no warm-up of the response cache at start,
+# which would render the replayed selections before they are measured, and no log of the requests, which would count
+# the replayed selections as the ones visitors ask for most (see `warmup.py`)
+BENCHMARK_ENV = {"DASH_WARMUP": "0", "DASH_WARMUP_LOG": "0"}
+os.environ.update(BENCHMARK_ENV)
+
+
+# Request body of the callback `key` of `app`, with the inputs and state in `values` (by "id.property") and the
+# layout values for the others
+def callback_body(app, key, values, changed):
+    components = {component.id: component for component in app.layout._traverse()
+                  if getattr(component, "id", None) is not None}
+
+    def value(argument):
+        name = f"{argument['id']}.{argument['property']}"
+        if name in values:
+            return values[name]
+        return getattr(components.get(argument["id"]), argument["property"], None)
+
+    callback = app.callback_map[key]
+    outputs = [dict(zip(("id", "property"), output.rsplit(".", 1))) for output in key.strip(".").split("...")]
+    return {
+        "output": key,
+        "outputs": outputs if key.startswith("..") else outputs[0],
+        "inputs": [dict(argument, value=value(argument)) for argument in callback["inputs"]],
+        "state": [dict(argument, value=value(argument)) for argument in callback.get("state", [])],
+        "changedPropIds": changed,
+    }
+
+
+# Requests of every server callback of `app` triggered when `prop` ("id.property") changes to `value`
+def interaction(app, prop, value, values=None):
+    values = dict(values or {}, **{prop: value})
+    return [callback_body(app, key, values, [prop]) for key, callback in app.callback_map.items()
+            if "callback" in callback and any(f"{argument['id']}.{argument['property']}" == prop
+                                              for argument in callback["inputs"])]
+
+
+def click(country):
+    return {"points": [{"location": country, "hovertext": country, "customdata": [country]}]}
+
+
+def slider_marks(app, slider_id):
+    slider = next(component for component in app.layout._traverse() if getattr(component, "id", None) == slider_id)
+    return [int(mark) for mark in slider.marks]
+
+
+# Scrub the year slider back and forth over every year
+def sanitation_map_year_scrub(module):
+    years = slider_marks(module.app, "year_slider")
+    return [interaction(module.app, "year_slider.value", year) for year in years + years[::-1]]
+
+
+# Click countries on the map one after the other
+def diarrhoea_map_clicks(module):
+    countries = sorted(module.df["Entity"].unique())[::4]
+    return [interaction(module.app, "map-year.clickData", click(country)) for country in countries]
+
+
+def diarrhoea_year_scrub(module):
+    years = slider_marks(module.app, "year-slider")
+    return [interaction(module.app, "year-slider.value", year) for year in years + years[::-1]]
+
+
+# Change the country selection of the charts one country at a time
+def intern_sanitation_countries(module):
+    countries = list(module.df_drinking["Country"].unique()[:20])
+    return [interaction(module.app, "country_dropdown.value", countries[:n]) for n in range(1, len(countries) + 1)]
+
+
+SCENARIOS = {
+    "sanitation_map_year_scrub": ("sanitation_map", sanitation_map_year_scrub),
+    "diarrhoea_map_clicks": ("diarrhoea_cleaning", diarrhoea_map_clicks),
+    "diarrhoea_year_scrub": ("diarrhoea_cleaning", diarrhoea_year_scrub),
+    "intern_sanitation_countries": ("intern_sanitation", intern_sanitation_countries),
+}
+
+
+class TestClientTarget:
+    def __init__(self, module):
+        self.server = module.server
+        self.local = threading.local()
+
+    def post(self, body):
+        if not hasattr(self.local, "client"):
+            self.local.client = self.server.test_client()
+        response = self.local.client.post("/_dash-update-component", data=body,
+                                          headers={"Content-Type": "application/json", "Accept-Encoding": "gzip"})
+        return response.status_code
+
+
+class HTTPTarget:
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+
+    def post(self, body):
+        if not hasattr(self.local, "connection"):
+            self.local.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        self.local.connection.request("POST", "/_dash-update-component", body=body,
+                                      headers={"Content-Type": "application/json", "Accept-Encoding": "gzip"})
+        response = self.local.connection.getresponse()
+        response.read()
+        return response.status
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(app_module, workers, threads, env, warmup_body):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", f"{app_module}:server", "--workers", str(workers),
+                                "--threads", str(threads), "--bind", f"127.0.0.1:{port}", "--log-level", "warning"],
+                               env=dict(env, **BENCHMARK_ENV))
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                break
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+            time.sleep(0.5)
+    else:
+        process.terminate()
+        raise RuntimeError("gunicorn did not start within 120 seconds")
+    # Wait for every worker to have imported the app, the first requests would otherwise measure the startup
+    for _ in range(workers * 2):
+        HTTPTarget(port).post(warmup_body)
+    return process, port
+
+
+# Run `interactions` from `concurrency` client threads for `duration` seconds
+def run_load(target, interactions, concurrency, duration):
+    bodies = [[json.dumps(body).encode() for body in requests] for requests in interactions]
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def client(offset):
+        local_latencies, local_errors = [], 0
+        for requests in itertools.islice(itertools.cycle(bodies), offset, None):
+            if time.monotonic() >= stop:
+                break
+            start = time.perf_counter()
+            for body in requests:
+                if target.post(body) not in (200, 204):
+                    local_errors += 1
+            local_latencies.append((time.perf_counter() - start) * 1e3)
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        # Clients start at different points of the sequence, like users that do not move in lockstep
+        list(pool.map(client, [i * len(bodies) // concurrency for i in range(concurrency)]))
+    elapsed = time.monotonic() - start
+
+    result = {"concurrency": concurrency, "interactions": len(latencies), "errors": errors[0],
+              "throughput": round(len(latencies) / elapsed, 2)}
+    if latencies:
+        result.update({f"p{q}_ms": round(float(np.percentile(latencies, q)), 2) for q in (50, 95, 99)})
+    return result
+
+
+def print_row(config, result):
+    print(f"{config:<22}{result['concurrency']:>6}{result['throughput']:>12.1f}{result.get('p50_ms', 0):>10.1f}"
+          f"{result.get('p95_ms', 0):>10.1f}{result.get('p99_ms', 0):>10.1f}{result['errors']:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the callbacks of a dashboard")
+    parser.add_argument("scenario", choices=SCENARIOS)
+    parser.add_argument("--mode", choices=["client", "gunicorn"], default="client")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1], help="gunicorn worker counts")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1], help="gunicorn threads per worker")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per concurrency level")
+    parser.add_argument("--cold", action="store_true", help="disable the response cache of compression.py")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.cold:
+        os.environ["DASH_RESPONSE_CACHE_SIZE"] = "0"
+    app_module, scenario = SCENARIOS[args.scenario]
+    module = importlib.import_module(app_module)
+    interactions = scenario(module)
+    print(f"{args.scenario}: {len(interactions)} interactions, "
+          f"{sum(len(requests) for requests in interactions)} callback requests per pass\n")
+    print(f"{'configuration':<22}{'users':>6}{'int/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+
+    results = []
+    if args.mode == "client":
+        target = TestClientTarget(module)
+        for concurrency in args.concurrency:
+            result = dict(run_load(target, interactions, concurrency, args.duration), configuration="test client")
+            print_row("test client", result)
+            results.append(result)
+    else:
+        for workers, threads in itertools.product(args.workers, args.threads):
+            config = f"{workers} workers x {threads} threads"
+            process, port = start_gunicorn(app_module, workers, threads, dict(os.environ),
+                                           json.dumps(interactions[0][0]).encode())
+            try:
+                for concurrency in args.concurrency:
+                    result = dict(run_load(HTTPTarget(port), interactions, concurrency, args.duration),
+                                  configuration=config, workers=workers, threads=threads)
+                    print_row(config, result)
+                    results.append(result)
+            finally:
+                process.terminate()
+                process.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"scenario": args.scenario, "mode": args.mode, "cold": args.cold, "results": results}, f,
+                      indent=1)
@@ -0,0 +1,97 @@
+# Memory of the gunicorn workers of a dashboard, by dataset sharing mode and worker count.
+#
+# For every mode (see `gunicorn.conf.py`) and every `--workers` count a gunicorn is started, a load test scenario is
+# replayed for a few seconds so that every worker has loaded its datasets and drawn some figures, and the memory of
+# each process is read from /proc/<pid>/smaps_rollup (Linux only):
+#
+# - USS, the unique set size: pages only this process maps, i.e. what the process costs on top of the others
+# - PSS, the proportional set size: shared pages split evenly between the processes that map them
+#
+# Memory that is shared across workers shows up as a small worker USS that does not grow with the worker count:
+#
+#   python benchmarks/worker_memory.py diarrhoea_map_clicks --workers 1 2 4 8
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+
+from load_test import ROOT, SCENARIOS, HTTPTarget, run_load, start_gunicorn
+
+# Mode -> environment of gunicorn, on top of `load_test.BENCHMARK_ENV`
+MODES = {
+    "copy": {"DASH_PRELOAD": "0", "DASH_DATA_MMAP": "0"},
+    "preload": {"DASH_PRELOAD": "1", "DASH_DATA_MMAP": "0"},
+    "mmap": {"DASH_PRELOAD": "0", "DASH_DATA_MMAP": "1"},
+    "preload+mmap": {"DASH_PRELOAD": "1", "DASH_DATA_MMAP": "1"},
+}
+
+
+# USS and PSS of a process, in bytes
+def process_memory(pid):
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[name] = int(value.split()[0]) * 1024
+    return {"uss": fields["Private_Clean"] + fields["Private_Dirty"], "pss": fields["Pss"]}
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def measure(app_module, interactions, mode, workers, duration):
+    env = dict(os.environ, **MODES[mode])
+    process, port = start_gunicorn(app_module, workers, 1, env, json.dumps(interactions[0][0]).encode())
+    try:
+        # Enough concurrent clients to reach every worker
+        run_load(HTTPTarget(port), interactions, workers * 2, duration)
+        time.sleep(1)
+        master = process_memory(process.pid)
+        worker_memory = [process_memory(pid) for pid in children(process.pid)]
+    finally:
+        process.terminate()
+        process.wait()
+
+    mib = 1 / (1 << 20)
+    return {
+        "mode": mode,
+        "workers": len(worker_memory),
+        "master_uss_mib": round(master["uss"] * mib, 1),
+        "worker_uss_mib": round(sum(memory["uss"] for memory in worker_memory) / len(worker_memory) * mib, 1),
+        "total_uss_mib": round((master["uss"] + sum(memory["uss"] for memory in worker_memory)) * mib, 1),
+        "total_pss_mib": round((master["pss"] + sum(memory["pss"] for memory in worker_memory)) * mib, 1),
+    }
+
+
+if __name__ == "__main__":
+    if not sys.platform.startswith("linux"):
+        raise SystemExit("worker_memory.py reads /proc and only runs on Linux")
+
+    parser = argparse.ArgumentParser(description="Measure the memory of the gunicorn workers of a dashboard")
+    parser.add_argument("scenario", choices=SCENARIOS, help="load test scenario replayed before measuring")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=5, help="seconds of load before measuring")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    app_module, scenario = SCENARIOS[args.scenario]
+    interactions = scenario(importlib.import_module(app_module))
+
+    print(f"{'mode':<14}{'workers':>8}{'master USS':>12}{'worker USS':>12}{'total USS':>11}{'total PSS':>11}  (MiB)")
+    results = []
+    for mode in args.modes:
+        for workers in args.workers:
+            result = measure(app_module, interactions, mode, workers, args.duration)
+            print(f"{mode:<14}{result['workers']:>8}{result['master_uss_mib']:>12.1f}{result['worker_uss_mib']:>12.1f}"
+                  f"{result['total_uss_mib']:>11.1f}{result['total_pss_mib']:>11.1f}")
+            results.append(result)
+
+    if args.output:
+        with open(os.path.join(ROOT, args.output), "w") as f:
+            json.dump({"scenario": args.scenario, "results": results}, f, indent=1)
@@ -0,0 +1,197 @@
+# Phase timing of the Dash callbacks, served in the Prometheus text format.
+#
+# With DASH_CALLBACK_METRICS=1, `instrument(app)` (called right after the app is created, before its callbacks are
+# registered) times every callback of the app and splits the time into phases:
+#
+# - "figure": building figures, i.e. the time spent in `plotly.express` functions and in `phase("figure")` blocks.
+#   Only `plotly.express` is timed on its own: callbacks that build `plotly.graph_objects` figures or figure dicts
+#   wrap that code in `phase("figure")`
+# - "filter": the rest of the callback function, mostly pandas filtering
+# - "serialize": Dash turning the returned value into the JSON response
+#
+# The durations are kept as histograms per callback (named after its outputs, e.g. `map-year.figure`) and served at
+# `/metrics` on the app's server. When the variable is not set nothing is wrapped or patched, and `phase()` returns a
+# shared no-op context manager.
+import contextlib
+import functools
+import os
+import threading
+import time
+
+from dash.exceptions import PreventUpdate
+from flask import Response
+
+ENABLED = os.environ.get("DASH_CALLBACK_METRICS", "0") == "1"
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_NULL_PHASE = contextlib.nullcontext()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+
+    # Prometheus buckets are cumulative
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6f}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class CallbackMetrics:
+    def __init__(self):
+        self.histograms = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def observe(self, callback_id, durations):
+        with self._lock:
+            for name, seconds in durations.items():
+                self.histograms.setdefault((callback_id, name), Histogram()).observe(seconds)
+
+    def error(self, callback_id):
+        with self._lock:
+            self.errors[callback_id] = self.errors.get(callback_id, 0) + 1
+
+    def render(self):
+        lines = ["# HELP dash_callback_phase_seconds Time spent in each phase of a Dash callback.",
+                 "# TYPE dash_callback_phase_seconds histogram"]
+        with self._lock:
+            for (callback_id, name), histogram in sorted(self.histograms.items()):
+                lines.extend(histogram.lines("dash_callback_phase_seconds",
+                                             f'callback="{callback_id}",phase="{name}"'))
+            lines += ["# HELP dash_callback_errors_total Dash callbacks that raised an exception.",
+                      "# TYPE dash_callback_errors_total counter"]
+            lines += [f'dash_callback_errors_total{{callback="{callback_id}"}} {count}'
+                      for callback_id, count in sorted(self.errors.items())]
+        return "\n".join(lines) + "\n"
+
+
+metrics = CallbackMetrics()
+
+
+class _Phase:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        phases = getattr(_local, "phases", None)
+        # Only the outermost phase counts, e.g. a plotly express call inside a `phase("figure")` block
+        self.active = phases is not None and not _local.depth
+        if self.active:
+            _local.depth += 1
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.active:
+            _local.depth -= 1
+            _local.phases[self.name] = _local.phases.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+# Attribute the time spent in the block to the phase `name` of the running callback
+def phase(name):
+    return _Phase(name) if ENABLED else _NULL_PHASE
+
+
+def _timed_function(func):
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if getattr(_local, "phases", None) is not None:
+                _local.function_seconds = time.perf_counter() - start
+    return timed
+
+
+def _timed_dispatch(dispatch, callback_id):
+    @functools.wraps(dispatch)
+    def timed(*args, **kwargs):
+        _local.phases, _local.depth, _local.function_seconds = {}, 0, 0.0
+        start = time.perf_counter()
+        try:
+            return dispatch(*args, **kwargs)
+        except PreventUpdate:
+            raise
+        except Exception:
+            metrics.error(callback_id)
+            raise
+        finally:
+            total = time.perf_counter() - start
+            phases, _local.phases = _local.phases, None
+            figure = phases.get("figure", 0.0)
+            metrics.observe(callback_id, {"filter": max(_local.function_seconds - figure, 0.0), "figure": figure,
+                                          "serialize": max(total - _local.function_seconds, 0.0), "total": total})
+    # Keep `__wrapped__` pointing at the callback function, as Dash sets it
+    timed.__wrapped__ = getattr(dispatch, "__wrapped__", dispatch)
+    return timed
+
+
+@functools.lru_cache(maxsize=None)
+def _patch_plotly_express():
+    import plotly.express as px
+
+    for name in dir(px):
+        func = getattr(px, name)
+        if callable(func) and getattr(func, "__module__", "") == "plotly.express._chart_types":
+            setattr(px, name, _figure_phase(func))
+
+
+def _figure_phase(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _Phase("figure"):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# `a.figure` for a single output, `a.figure,b.figure` for several
+def callback_id(key):
+    return key.strip(".").replace("...", ",")
+
+
+def instrument(app):
+    if not ENABLED:
+        return
+    _patch_plotly_express()
+
+    register = app.callback
+
+    @functools.wraps(register)
+    def callback(*args, **kwargs):
+        # Dash adds the entry of the callback to `callback_map` here and its dispatch function in `decorator`
+        before = set(app.callback_map)
+        decorator = register(*args, **kwargs)
+        keys = set(app.callback_map) - before
+
+        def wrap(func):
+            result = decorator(_timed_function(func))
+            for key in keys:
+                app.callback_map[key]["callback"] = _timed_dispatch(app.callback_map[key]["callback"],
+                                                                    callback_id(key))
+            return result
+        return wrap
+
+    app.callback = callback
+    app.server.add_url_rule("/metrics", endpoint="callback_metrics",
+                            view_func=lambda: Response(metrics.render(), mimetype="text/plain; version=0.0.4"))
@@ -0,0 +1,187 @@
+# Ahead-of-time conversion of the wide census tables used by the census dashboards (`human_sanitation.py`,
+# `stack_barchart.py`, `stack_barchart2.py`, `sanitation_pie_chart.py`, `sanitation_pie_chart2.py` and `county_map.py`).
+#
+# Source of the data used is the Kenya 2019 census: percentage of conventional households by main mode of human waste
+# disposal, one row per county
+#
+# Run `python census_etl.py` after changing `human_waste_filtered.csv`. When the artifact was built from another version
+# of the CSV, the dashboards build their own copy under `.cache/census/<content key>` instead, like
+# `columnar_cache.ensure_cache` does. The wide table (one row per area, the number of households followed by one
+# percentage column per disposal method) is read in chunks and every chunk is turned into rows of a long table with
+# typed columns, which are appended to the column files of the artifact (see `columnar_cache.FrameWriter`) before the
+# next chunk is read. Memory therefore depends on the chunk size and on the number of distinct area names, not on the
+# number of rows:
+#
+#   County | Conventional Households | indicator | percent
+#   category | uint32, parsed from "141,877" | category, the method | float32
+#
+# The rows of an area are consecutive, with the methods in the order of the source columns. The dashboards only load
+# the artifact, memory-mapped when DASH_DATA_MMAP=1, and get the percentages as float64 (see
+# `schema.decimal_float64`). For another table, e.g. by ward, pass its area and count columns:
+# `python census_etl.py wards.csv --id-columns County Ward --target data/wards`
+import argparse
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from dash.dash_table.Format import Format, Group
+
+from columnar_cache import FrameWriter, _prune, file_digest, load_frame, read_meta
+from schema import Schema
+
+SOURCE_CSV = "human_waste_filtered.csv"
+
+# Columns naming the area of a row, and columns holding counts written with thousands separators
+ID_COLUMNS = ("County",)
+COUNT_COLUMNS = ("Conventional Households",)
+
+# Rows of the wide table parsed at a time
+CHUNK_ROWS = 10000
+
+# Bump this whenever the conversion below changes; the version is part of the artifact directory name
+ARTIFACT_VERSION = 1
+ARTIFACT_DIR = f"data/census_sanitation_v{ARTIFACT_VERSION}"
+
+# Where the dashboards build the artifacts of the source files that `ARTIFACT_DIR` was not built from
+CACHE_DIR = os.path.join(".cache", "census")
+
+
+# Long table of one chunk of the wide table: every area repeated once per method
+def melt_chunk(chunk, id_columns, count_columns, percent_columns):
+    repeats = len(percent_columns)
+    columns = {}
+    for column in id_columns:
+        values = np.repeat(chunk[column].to_numpy(dtype=object), repeats)
+        columns[column] = pd.Categorical(values, categories=pd.unique(values))
+    for column in count_columns:
+        counts = chunk[column]
+        if counts.isna().any():
+            raise ValueError(f"{column!r} is missing for {chunk.loc[counts.isna(), list(id_columns)].values.tolist()}")
+        if (counts < 0).any() or counts.max() > np.iinfo(np.uint32).max or (counts % 1 != 0).any():
+            raise ValueError(f"{column!r} holds values that are not household counts")
+        columns[column] = np.repeat(counts.to_numpy(dtype=np.uint32), repeats)
+    columns["indicator"] = pd.Categorical.from_codes(np.tile(np.arange(repeats, dtype=np.int8), len(chunk)),
+                                                     percent_columns)
+    columns["percent"] = chunk[percent_columns].to_numpy(dtype=np.float32).reshape(-1)
+    return pd.DataFrame(columns)
+
+
+# The long table, one chunk of `chunk_rows` areas at a time
+def melt_chunks(source=SOURCE_CSV, id_columns=ID_COLUMNS, count_columns=COUNT_COLUMNS, chunk_rows=CHUNK_ROWS):
+    id_columns, count_columns = list(id_columns), list(count_columns)
+    # "141,877" -> 141877 while parsing, in every numeric column
+    reader = pd.read_csv(source, chunksize=chunk_rows, thousands=",", dtype={column: str for column in id_columns})
+
+    percent_columns = None
+    for chunk in reader:
+        if percent_columns is None:
+            percent_columns = [column for column in chunk.columns
+                               if column not in id_columns and column not in count_columns]
+        yield melt_chunk(chunk, id_columns, count_columns, percent_columns)
+
+
+# Write the long table of `source` into `directory`. Returns the number of rows
+def write(source, directory, **kwargs):
+    writer = FrameWriter(directory)
+    for chunk in melt_chunks(source, **kwargs):
+        writer.append(chunk)
+    writer.close(extra_meta={"artifact_version": ARTIFACT_VERSION, "source": source,
+                             "source_digest": file_digest(source)})
+    return writer.rows
+
+
+# Write the artifact next to `target` and move it in place once complete, so that a dashboard never loads a partly
+# written one. Returns the number of rows. Only the command line replaces an existing artifact this way, one process at
+# a time; the dashboards never write to `target`, see `ensure_census`
+def build(source=SOURCE_CSV, target=ARTIFACT_DIR, **kwargs):
+    parent = os.path.dirname(os.path.abspath(target))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".build-")
+    try:
+        rows = write(source, tmp, **kwargs)
+        if os.path.exists(target):
+            os.rename(target, f"{tmp}.old")
+        os.rename(tmp, target)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.rmtree(f"{tmp}.old", ignore_errors=True)
+    return rows
+
+
+# Return the artifact directory of `source` under `cache_dir`, named by its content key, building it first if no
+# process did yet. Concurrent workers may build it at the same time: each writes its own `.build-*` directory and the
+# first rename wins, the others fail on its directory and use it
+def ensure_census(source=SOURCE_CSV, cache_dir=CACHE_DIR):
+    key = file_digest(source, extra=f"census v{ARTIFACT_VERSION}")
+    target = os.path.join(cache_dir, key)
+    if not os.path.exists(os.path.join(target, "meta.json")):
+        print(f"Building {target} from {source}")
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=cache_dir, prefix=".build-")
+        try:
+            write(source, tmp)
+            os.rename(tmp, target)
+        except OSError:
+            if not os.path.exists(os.path.join(target, "meta.json")):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        _prune(cache_dir, keep=key)
+    return target
+
+
+# Load the long census table: `target` if it was built from the current version of the source, the artifact of
+# `ensure_census` otherwise. The percentages are stored as float32 and handed out as the float64 numbers of the CSV
+def load_census(target=ARTIFACT_DIR):
+    if not is_current(target):
+        print(f"{target} is missing or out of date, run `python census_etl.py`")
+        target = ensure_census()
+    return Schema.widen(load_frame(target))
+
+
+# The wide table again, with typed columns: one row per area, its counts, then one percentage column per method
+def census_wide(df):
+    methods = list(df["indicator"].cat.categories)
+    keys = [column for column in df.columns if column not in ("indicator", "percent")]
+    wide = df[keys].iloc[::len(methods)].reset_index(drop=True)
+    wide = wide.astype({column: str for column in keys if isinstance(wide[column].dtype, pd.CategoricalDtype)})
+    percents = pd.DataFrame(df["percent"].to_numpy().reshape(-1, len(methods)), columns=methods)
+    return pd.concat([wide, percents], axis=1)
+
+
+# `dash_table.DataTable` columns of `census_wide`, showing the counts with thousands separators as the census does
+def table_columns(wide):
+    return [{"name": column, "id": column, "type": "numeric", "format": Format().group(Group.yes)}
+            if wide[column].dtype.kind in "iu" else {"name": column, "id": column} for column in wide.columns]
+
+
+# Whether the artifact was built from the current version of its source file
+def is_current(target=ARTIFACT_DIR):
+    try:
+        meta = read_meta(target)
+        return (meta.get("artifact_version") == ARTIFACT_VERSION
+                and meta.get("source_digest") == file_digest(meta.get("source", SOURCE_CSV)))
+    except OSError:
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a wide census table into the typed long table of the "
+                                                 "census dashboards")
+    parser.add_argument("source", nargs="?", default=SOURCE_CSV)
+    parser.add_argument("--target", default=ARTIFACT_DIR, help="artifact directory")
+    parser.add_argument("--id-columns", nargs="+", default=list(ID_COLUMNS), help="columns naming the area of a row")
+    parser.add_argument("--count-columns", nargs="+", default=list(COUNT_COLUMNS),
+                        help="columns of household counts, written with thousands separators")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--check", action="store_true", help="only report whether the artifact is up to date")
+    args = parser.parse_args()
+
+    if args.check:
+        print("up to date" if is_current(args.target) else "out of date")
+        raise SystemExit(0 if is_current(args.target) else 1)
+    rows = build(args.source, args.target, id_columns=args.id_columns, count_columns=args.count_columns,
+                 chunk_rows=args.chunk_rows)
+    print(f"Wrote {rows} rows to {args.target}")
@@ -0,0 +1,264 @@
+# Columnar on-disk cache for the CSV files used by the dashboards.
+#
+# Parsing quoted CSV text is the slowest part of starting any of the apps, and every gunicorn worker used to do it
+# again. `cached_read_csv` parses a CSV once and stores each column as a typed `.npy` file. Later loads only read
+# those arrays back. String columns are stored as integer codes plus a table of unique values.
+#
+# Layout of the cache for one source file:
+#
+#   .cache/columnar/<source slug>/source.json     <- mtime, size and content key of the CSV the cache was built from
+#   .cache/columnar/<source slug>/<content key>/  <- meta.json + one .npy file per column
+#
+# The content key is a hash of the CSV bytes (plus the read options), so a cache directory can never describe any
+# other version of the file. `source.json` is only a shortcut: if the mtime or size of the CSV differ from it, the
+# file is hashed again before any cache directory is used.
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = os.environ.get("DASH_DATA_CACHE", os.path.join(".cache", "columnar"))
+
+# Bump this whenever the on-disk layout changes so that old cache directories get rebuilt
+CACHE_VERSION = 1
+
+# Seconds after which a `.build-*` directory is taken for the leftover of a crashed build and removed. Younger ones
+# may still be written to by another process
+BUILD_TIMEOUT = 3600
+
+# With DASH_DATA_MMAP=1 the numeric columns and the codes of the category columns are memory-mapped read-only instead
+# of read into memory, and every process that loads the same cache directory shares their pages (the page cache).
+# Only those arrays are shared: the tables of category values, the decoded "string" columns and any frame an app
+# derives from the loaded one (a sorted copy, a pivot) are private to each process. The saving per worker is the size
+# of the arrays, which is small next to the imported libraries that only gunicorn's preload shares. See
+# `gunicorn.conf.py`
+MMAP_MODE = "r" if os.environ.get("DASH_DATA_MMAP", "0") == "1" else None
+
+
+# Hash the content of a file in chunks
+def file_digest(path, extra=""):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"v{CACHE_VERSION}:{extra}".encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Smallest signed integer type that can hold the string codes (-1 marks a missing value)
+def _code_dtype(n_categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+# Write a dataframe into `directory` as one .npy file per column
+def save_frame(df, directory, extra_meta=None):
+    os.makedirs(directory, exist_ok=True)
+    columns = []
+    for i, name in enumerate(df.columns):
+        series = df[name]
+        column = {"name": name, "dtype": str(series.dtype)}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            categories = series.cat.categories.to_numpy()
+            column["kind"] = "category"
+        elif series.dtype.kind in "biufcmM":
+            codes, categories = series.to_numpy(), None
+            column["kind"] = "numeric"
+        else:
+            codes, categories = pd.factorize(series, use_na_sentinel=True)
+            column["kind"] = "string"
+        if categories is not None:
+            codes = codes.astype(_code_dtype(len(categories)))
+            np.save(os.path.join(directory, f"c{i}.categories.npy"), np.asarray(categories, dtype=str))
+        np.save(os.path.join(directory, f"c{i}.npy"), codes)
+        columns.append(column)
+
+    meta = {"version": CACHE_VERSION, "rows": len(df), "columns": columns}
+    meta.update(extra_meta or {})
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+
+# Write a dataframe into `directory` chunk by chunk, in the layout of `save_frame`, for tables that are too large to
+# be held in memory at once. Every chunk has the same columns with the same dtypes; the values of the category and
+# string columns are coded against all the values seen so far. Each column is appended to a raw file and turned into
+# its .npy file by `close`, block by block
+class FrameWriter:
+    BLOCK_ROWS = 1 << 20
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.rows = 0
+        self.columns = None
+        self._files = []
+        self._values = []
+        os.makedirs(directory, exist_ok=True)
+
+    def _part(self, i):
+        return os.path.join(self.directory, f"c{i}.npy.part")
+
+    def append(self, df):
+        if self.columns is None:
+            self.columns = []
+            for i, name in enumerate(df.columns):
+                series = df[name]
+                if isinstance(series.dtype, pd.CategoricalDtype):
+                    kind, dtype = "category", np.dtype(np.int32)
+                elif series.dtype.kind in "biufcmM":
+                    kind, dtype = "numeric", series.dtype
+                else:
+                    kind, dtype = "string", np.dtype(np.int32)
+                self.columns.append({"name": name, "dtype": str(series.dtype), "kind": kind, "part_dtype": dtype})
+                self._files.append(open(self._part(i), "wb"))
+                self._values.append({} if kind != "numeric" else None)
+        elif list(df.columns) != [column["name"] for column in self.columns]:
+            raise ValueError(f"Chunk columns {list(df.columns)} differ from the first chunk")
+
+        for column, f, values in zip(self.columns, self._files, self._values):
+            series = df[column["name"]]
+            if column["kind"] == "numeric":
+                if series.dtype != column["part_dtype"]:
+                    raise ValueError(f"Column {column['name']!r} is {series.dtype} in this chunk, "
+                                     f"{column['part_dtype']} in the first one")
+                f.write(series.to_numpy().tobytes())
+                continue
+            if column["kind"] == "category":
+                codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+            else:
+                codes, uniques = pd.factorize(series, use_na_sentinel=True)
+            # Codes of this chunk -> codes over every chunk, -1 (missing) stays -1
+            mapping = np.array([values.setdefault(value, len(values)) for value in uniques] + [-1], dtype=np.int32)
+            f.write(mapping[codes].tobytes())
+        self.rows += len(df)
+
+    def close(self, extra_meta=None):
+        columns = []
+        for i, (column, f, values) in enumerate(zip(self.columns or [], self._files, self._values)):
+            f.close()
+            dtype = column.pop("part_dtype")
+            if values is not None:
+                np.save(os.path.join(self.directory, f"c{i}.categories.npy"), np.asarray(list(values), dtype=str))
+            target = np.lib.format.open_memmap(os.path.join(self.directory, f"c{i}.npy"), mode="w+",
+                                               dtype=_code_dtype(len(values)) if values is not None else dtype,
+                                               shape=(self.rows,))
+            with open(self._part(i), "rb") as part:
+                for start in range(0, self.rows, self.BLOCK_ROWS):
+                    block = np.fromfile(part, dtype=dtype, count=self.BLOCK_ROWS)
+                    target[start:start + len(block)] = block
+            target.flush()
+            del target
+            os.remove(self._part(i))
+            columns.append(column)
+
+        meta = {"version": CACHE_VERSION, "rows": self.rows, "columns": columns}
+        meta.update(extra_meta or {})
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+
+def read_meta(directory):
+    with open(os.path.join(directory, "meta.json")) as f:
+        return json.load(f)
+
+
+# Read a dataframe written by `save_frame`. With `mmap_mode="r"` the columns are read-only views of the files
+def load_frame(directory, columns=None, mmap_mode=MMAP_MODE):
+    meta = read_meta(directory)
+    data = {}
+    for i, column in enumerate(meta["columns"]):
+        name = column["name"]
+        if columns is not None and name not in columns:
+            continue
+        values = np.load(os.path.join(directory, f"c{i}.npy"), mmap_mode=mmap_mode)
+        if column["kind"] == "numeric":
+            data[name] = values
+            continue
+        categories = np.load(os.path.join(directory, f"c{i}.categories.npy")).astype(object)
+        if column["kind"] == "category":
+            data[name] = pd.Categorical.from_codes(values, categories)
+        else:
+            decoded = categories.take(values, mode="clip")
+            decoded[values < 0] = np.nan
+            data[name] = pd.Series(decoded, dtype=object).astype(column["dtype"])
+    return pd.DataFrame(data, copy=False)
+
+
+def _slug(path):
+    return os.path.normpath(path).replace(os.sep, "__").replace(" ", "_")
+
+
+def _write_json(path, payload):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+
+# Remove cache directories built from older versions of the source file, and builds abandoned by crashed processes
+def _prune(source_dir, keep):
+    now = time.time()
+    for entry in os.listdir(source_dir):
+        full_path = os.path.join(source_dir, entry)
+        if entry == keep or not os.path.isdir(full_path):
+            continue
+        if entry.startswith(".build-"):
+            try:
+                if now - os.stat(full_path).st_mtime < BUILD_TIMEOUT:
+                    continue
+            except OSError:
+                continue
+        shutil.rmtree(full_path, ignore_errors=True)
+
+
+# Return the cache directory for `csv_path`, building it first if the CSV changed since the last build
+def ensure_cache(csv_path, cache_dir=None, **read_csv_kwargs):
+    source_dir = os.path.join(cache_dir or CACHE_DIR, _slug(csv_path))
+    os.makedirs(source_dir, exist_ok=True)
+    pointer_path = os.path.join(source_dir, "source.json")
+    options = json.dumps(read_csv_kwargs, sort_keys=True, default=str)
+
+    stat = os.stat(csv_path)
+    try:
+        with open(pointer_path) as f:
+            pointer = json.load(f)
+    except (OSError, ValueError):
+        pointer = {}
+
+    # Fast path: the CSV was not touched since the cache was built
+    if (pointer.get("mtime_ns") == stat.st_mtime_ns and pointer.get("size") == stat.st_size
+            and pointer.get("options") == options and pointer.get("version") == CACHE_VERSION):
+        key = pointer["key"]
+    else:
+        key = file_digest(csv_path, extra=options)
+
+    target = os.path.join(source_dir, key)
+    if not os.path.exists(os.path.join(target, "meta.json")):
+        df = pd.read_csv(csv_path, **read_csv_kwargs)
+        tmp = tempfile.mkdtemp(dir=source_dir, prefix=".build-")
+        try:
+            save_frame(df, tmp, extra_meta={"source": csv_path})
+            os.rename(tmp, target)
+        except OSError:
+            # Another worker finished the same build first: the rename fails on its directory
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.exists(os.path.join(target, "meta.json")):
+                raise
+        _prune(source_dir, keep=key)
+
+    if pointer.get("key") != key or pointer.get("mtime_ns") != stat.st_mtime_ns:
+        _write_json(pointer_path, {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "key": key,
+                                   "options": options, "version": CACHE_VERSION})
+    return target
+
+
+# Drop-in replacement for `pd.read_csv` that goes through the columnar cache
+def cached_read_csv(csv_path, cache_dir=None, mmap_mode=MMAP_MODE, **read_csv_kwargs):
+    return load_frame(ensure_cache(csv_path, cache_dir=cache_dir, **read_csv_kwargs), mmap_mode=mmap_mode)
@@ -0,0 +1,148 @@
+# Compression and caching of the JSON responses of a Dash app.
+#
+# Figures go from the Flask server to the browser as plain JSON, and a choropleth or treemap is easily several hundred
+# KB. `install_compression(app)` adds a response layer to `app.server` that:
+#
+# - compresses the responses of the Dash routes (`_dash-update-component`, `_dash-layout`, `_dash-dependencies`) with
+#   brotli when the `brotli` package is installed and the browser accepts it, gzip otherwise
+# - keeps the compressed bytes of callback responses, keyed by the callback request (output, inputs, state and the
+#   triggering props). A repeated request, e.g. going back to a selection, is answered from them without running the
+#   callback, serializing the figure or compressing it again
+# - records the compression ratio and CPU time per endpoint (the callback output, or the route). They are served as
+#   JSON at `/_compression-stats`
+#
+# Only callbacks that are functions of their inputs and state may be cached. Pass the output ids of any other callback
+# in `uncached`. An app whose data can change while it runs passes a `version` function returning the current version
+# of its data, which is part of the cache key.
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from flask import Response, g, jsonify, request
+
+from trace_cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("DASH_RESPONSE_CACHE_SIZE", 256))
+
+# Responses smaller than this are sent as they are: compression would not save a round trip
+MIN_SIZE = 500
+
+COMPRESSORS = {"gzip": lambda data: gzip.compress(data, compresslevel=6)}
+if brotli is not None:
+    COMPRESSORS = {"br": lambda data: brotli.compress(data, quality=5), **COMPRESSORS}
+
+
+class ResponseCompression:
+    def __init__(self, app, cache_size=RESPONSE_CACHE_SIZE, uncached=(), version=None):
+        self.prefix = app.config.routes_pathname_prefix
+        self.version = version
+        self.cache = LRUCache(cache_size)
+        self.uncached = set(uncached)
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+        app.server.before_request(self.before_request)
+        app.server.after_request(self.after_request)
+        app.server.add_url_rule(f"{self.prefix}_compression-stats", endpoint="compression_stats",
+                                view_func=lambda: jsonify(self.stats()))
+
+    def _route(self):
+        if request.path.startswith(self.prefix):
+            route = request.path[len(self.prefix):]
+            if route in ("_dash-update-component", "_dash-layout", "_dash-dependencies"):
+                return route
+        return None
+
+    # Canonical key of a callback request and the endpoint name (its output) it is reported under
+    def callback_key(self, body):
+        payload = json.loads(body)
+        key = {field: payload.get(field) for field in ("output", "inputs", "state", "changedPropIds")}
+        if self.version is not None:
+            key["version"] = self.version()
+        key = json.dumps(key, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.blake2b(key.encode(), digest_size=16).digest(), payload.get("output")
+
+    def _record(self, endpoint, raw_bytes, sent_bytes, cpu_seconds, hit):
+        with self._lock:
+            stats = self.endpoints.setdefault(endpoint, {"requests": 0, "cache_hits": 0, "raw_bytes": 0,
+                                                         "sent_bytes": 0, "cpu_seconds": 0.0})
+            stats["requests"] += 1
+            stats["cache_hits"] += hit
+            stats["raw_bytes"] += raw_bytes
+            stats["sent_bytes"] += sent_bytes
+            stats["cpu_seconds"] += cpu_seconds
+
+    @staticmethod
+    def _response(content, encoding, mimetype):
+        response = Response(content, mimetype=mimetype)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def before_request(self):
+        g.compression_route = self._route()
+        if g.compression_route != "_dash-update-component" or request.method != "POST":
+            return None
+
+        g.compression_key, g.compression_endpoint = self.callback_key(request.get_data())
+        encoding = request.accept_encodings.best_match(list(COMPRESSORS)) or "identity"
+        cached = None if g.compression_endpoint in self.uncached else self.cache.get(g.compression_key)
+        if cached is None:
+            return None
+
+        # A hit skips the callback. The encoding the browser asked for may not have been built yet
+        if encoding not in cached["content"]:
+            start = time.thread_time()
+            cached["content"][encoding] = COMPRESSORS[encoding](cached["content"]["identity"])
+            cpu_seconds = time.thread_time() - start
+        else:
+            cpu_seconds = 0.0
+        content = cached["content"][encoding]
+        self._record(g.compression_endpoint, len(cached["content"]["identity"]), len(content), cpu_seconds, True)
+        g.compression_route = None
+        return self._response(content, encoding, cached["mimetype"])
+
+    def after_request(self, response):
+        route = g.get("compression_route")
+        if route is None or response.status_code != 200 or response.direct_passthrough \
+                or "Content-Encoding" in response.headers:
+            return response
+
+        data = response.get_data()
+        encoding = request.accept_encodings.best_match(list(COMPRESSORS)) if len(data) >= MIN_SIZE else None
+        start = time.thread_time()
+        content = COMPRESSORS[encoding](data) if encoding else data
+        cpu_seconds = time.thread_time() - start
+        encoding = encoding or "identity"
+
+        endpoint = g.get("compression_endpoint", route)
+        self._record(endpoint, len(data), len(content), cpu_seconds, False)
+        if "compression_key" in g and endpoint not in self.uncached:
+            self.cache.put(g.compression_key, {"mimetype": response.mimetype,
+                                               "content": {"identity": data, encoding: content}})
+
+        response.set_data(content)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def stats(self):
+        with self._lock:
+            endpoints = {endpoint: dict(stats, ratio=round(stats["raw_bytes"] / max(stats["sent_bytes"], 1), 2),
+                                        cpu_ms_per_request=round(1000 * stats["cpu_seconds"] / stats["requests"], 3))
+                         for endpoint, stats in self.endpoints.items()}
+        return {"encodings": list(COMPRESSORS), "cached_responses": len(self.cache), "endpoints": endpoints}
+
+
+def install_compression(app, **kwargs):
+    return ResponseCompression(app, **kwargs)
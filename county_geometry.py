@@ -0,0 +1,293 @@
+# Kenya county boundaries from `mygeodata/County.json`, simplified for web maps.
+#
+# The GeoJSON is 2.6 MB at full resolution, far more detail than a county choropleth needs. The counties are
+# simplified with the Douglas-Peucker algorithm at a few tolerances, and the map picks one based on the zoom level.
+#
+# Simplifying every polygon on its own would give each side of a border between two counties a different shape,
+# leaving gaps and overlaps between them. Instead the rings are cut into arcs where the set of counties sharing the
+# vertices changes (as TopoJSON does). Each shared border is simplified once, and the same simplified arc is used
+# by both counties along it.
+import functools
+import json
+import os
+import re
+import tempfile
+
+import numpy as np
+
+from columnar_cache import CACHE_DIR, file_digest
+
+GEOJSON_PATH = "mygeodata/County.json"
+
+# Simplification tolerance in degrees for each level of detail, from the whole country view to a close zoom
+TOLERANCES = {0: 0.02, 1: 0.005, 2: 0.001}
+
+# Decimal places kept in the simplified coordinates (4 decimals is about 11 m)
+PRECISION = 4
+
+# Longest run of one-sided vertices inside a shared border that is still treated as part of that border
+MAX_GAP = 16
+
+# Census names that do not match the GeoJSON names after normalisation
+NAME_ALIASES = {"NAIROBICITY": "NAIROBI"}
+
+
+# Upper case letters and digits only, so that "ELGEYO/MARAKWET", "Elgeyo Marakwet" and "Elgeyo-Marakwet" agree
+def normalize_name(name):
+    key = re.sub(r"[^A-Z0-9]", "", str(name).upper())
+    return NAME_ALIASES.get(key, key)
+
+
+# Map each census county name to the `Name` of its GeoJSON feature. Names without a match are left out
+def join_index(census_names, feature_names):
+    features = {normalize_name(name): name for name in feature_names}
+    return {name: features[normalize_name(name)] for name in census_names if normalize_name(name) in features}
+
+
+def load_geojson(path=GEOJSON_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Polygons of a feature as a list of lists of rings, whether it is a Polygon or a MultiPolygon
+def _polygons(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    return geometry["coordinates"]
+
+
+# Indices of the points kept by Douglas-Peucker on an open line (both end points are always kept)
+def _douglas_peucker(points, tolerance):
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, stop = stack.pop()
+        if stop - start < 2:
+            continue
+        segment = points[start + 1:stop]
+        a, b = points[start], points[stop]
+        ab = b - a
+        length = np.hypot(*ab)
+        if length == 0:
+            distances = np.hypot(*(segment - a).T)
+        else:
+            distances = np.abs(ab[0] * (segment[:, 1] - a[1]) - ab[1] * (segment[:, 0] - a[0])) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, stop))
+    return np.flatnonzero(keep)
+
+
+# Simplify an arc so that the result does not depend on the direction the arc is walked in. Two neighbouring
+# counties walk their common border in opposite directions and must get exactly the same simplified border
+def _simplify_arc(arc, tolerance):
+    reverse = tuple(arc[0]) > tuple(arc[-1])
+    if reverse:
+        arc = arc[::-1]
+    simplified = arc[_douglas_peucker(arc, tolerance)]
+    return simplified[::-1] if reverse else simplified
+
+
+class CountyTopology:
+    def __init__(self, geojson):
+        self.geojson = geojson
+        self.names = [feature["properties"]["Name"] for feature in geojson["features"]]
+
+        # All rings as (n, 2) arrays, with their position in the features: (feature, polygon, ring)
+        self.rings, self.ring_keys = [], []
+        for f, feature in enumerate(geojson["features"]):
+            for p, polygon in enumerate(_polygons(feature["geometry"])):
+                for r, ring in enumerate(polygon):
+                    self.rings.append(np.asarray(ring, dtype=float))
+                    self.ring_keys.append((f, p, r))
+
+        members = {}
+        for i, ring in enumerate(self.rings):
+            for point in map(tuple, ring[:-1]):
+                members.setdefault(point, set()).add(i)
+        labels = [[frozenset(members[point]) for point in map(tuple, ring[:-1])] for ring in self.rings]
+
+        # The shared borders in this file are not digitised vertex for vertex: the common vertices alternate with
+        # vertices that only one of the two counties has. The vertices between two consecutive common vertices of a
+        # border are counted as part of that border when every county along it has a short gap there. The decision is
+        # made for the pair of common vertices, so all the counties along a border cut it at the same points
+        gaps = {}
+        for ring, ring_labels in zip(self.rings, labels):
+            for a, b, gap in self._gaps(ring, ring_labels):
+                key = (ring_labels[a],) + tuple(sorted((tuple(ring[a]), tuple(ring[b]))))
+                gaps.setdefault(key, []).append(gap)
+        fill = {key for key, ring_gaps in gaps.items() if len(ring_gaps) == len(key[0]) and max(ring_gaps) <= MAX_GAP}
+
+        for ring, ring_labels in zip(self.rings, labels):
+            n = len(ring_labels)
+            for a, b, gap in self._gaps(ring, ring_labels):
+                if (ring_labels[a],) + tuple(sorted((tuple(ring[a]), tuple(ring[b])))) in fill:
+                    for j in range(a + 1, a + 1 + gap):
+                        ring_labels[j % n] = ring_labels[a]
+
+        self.arcs = [self._cut(ring, ring_labels) for ring, ring_labels in zip(self.rings, labels)]
+
+    # (a, b, number of vertices in between) for consecutive common vertices a and b of the same border
+    @staticmethod
+    def _gaps(ring, labels):
+        n = len(labels)
+        shared = [j for j in range(n) if len(labels[j]) > 1]
+        return [(a, b, (b - a - 1) % n) for a, b in zip(shared, shared[1:] + shared[:1])
+                if labels[a] == labels[b]]
+
+    # Cut a closed ring into arcs. Each arc is a (label, points) pair: the label is the set of rings along a shared
+    # border, or None for a stretch that belongs to this ring only
+    @staticmethod
+    def _cut(ring, labels):
+        points = ring[:-1]
+        n = len(points)
+
+        # Cut at the first and last vertex of every border
+        cuts = {j for j in range(n) if len(labels[j]) > 1
+                and (labels[j] != labels[j - 1] or labels[j] != labels[(j + 1) % n])}
+        if len(cuts) < 3:
+            # Rings with no (or almost no) shared border: cut at the extreme points so that the simplified ring keeps
+            # a polygon shape
+            cuts.update(int(j) for j in (points[:, 0].argmin(), points[:, 0].argmax(),
+                                         points[:, 1].argmin(), points[:, 1].argmax()))
+        cuts = sorted(cuts)
+
+        arcs = []
+        closed = np.vstack([points, points])
+        for a, b in zip(cuts, cuts[1:] + [cuts[0] + n]):
+            label = labels[a] if len(labels[a]) > 1 and labels[a] == labels[b % n] and all(
+                labels[j % n] == labels[a] for j in range(a, b)) else None
+            arcs.append((label, closed[a:b + 1]))
+        return arcs
+
+    # GeoJSON FeatureCollection with every shared border simplified the same way on both sides
+    def simplified(self, tolerance, precision=PRECISION):
+        borders = {}
+        rings = {}
+        for key, arcs in zip(self.ring_keys, self.arcs):
+            parts = []
+            for label, arc in arcs:
+                if label is None:
+                    simplified = _simplify_arc(arc, tolerance)
+                else:
+                    # Both counties along a border use the simplified arc of whichever of them came first
+                    border = (label,) + tuple(sorted((tuple(arc[0]), tuple(arc[-1]))))
+                    if border not in borders:
+                        borders[border] = _simplify_arc(arc, tolerance)
+                    simplified = borders[border]
+                    if not np.array_equal(simplified[0], arc[0]):
+                        simplified = simplified[::-1]
+                parts.append(simplified[:-1])
+            coordinates = np.round(np.vstack(parts + [parts[0][:1]]), precision)
+            rings[key] = coordinates.tolist()
+
+        features = []
+        for f, feature in enumerate(self.geojson["features"]):
+            polygons = [[rings[(f, p, r)] for r in range(len(polygon))]
+                        for p, polygon in enumerate(_polygons(feature["geometry"]))]
+            geometry = ({"type": "Polygon", "coordinates": polygons[0]} if feature["geometry"]["type"] == "Polygon"
+                        else {"type": "MultiPolygon", "coordinates": polygons})
+            features.append({"type": "Feature", "properties": {"Name": self.names[f]}, "geometry": geometry})
+        return {"type": "FeatureCollection", "features": features}
+
+
+# Simplified county geometry at every level of detail in `TOLERANCES`
+def build_levels(geojson=None):
+    topology = CountyTopology(geojson or load_geojson())
+    return {level: topology.simplified(tolerance) for level, tolerance in TOLERANCES.items()}
+
+
+# Smallest geo projection scale at which each level of detail is used (1 is the fitted view of the whole country)
+LEVEL_MIN_SCALES = {0: 0, 1: 2, 2: 6}
+
+
+# Level of detail for a geo subplot zoomed to `scale`
+def level_for_scale(scale):
+    return max(level for level, min_scale in LEVEL_MIN_SCALES.items() if (scale or 0) >= min_scale)
+
+
+# Encoded geometry
+#
+# The browser gets each level of detail once, as a static JSON asset in a compact TopoJSON-like form: coordinates
+# are quantized to integers on a 10^-PRECISION degree grid and every ring is delta encoded
+#
+#   {"names": [...], "scale": 0.0001, "translate": [x0, y0],
+#    "features": [[[[x, y, dx, dy, dx, dy, ...], <more rings>], <more polygons>], <more features>]}
+#
+# The arrays behind it are kept in a binary cache (.npz) keyed by the hash of the GeoJSON, so only the first process
+# after a change of `County.json` parses the GeoJSON and simplifies the counties.
+GEOMETRY_CACHE_DIR = os.path.join(os.path.dirname(CACHE_DIR), "county_geometry")
+
+
+# Flatten a simplified FeatureCollection into quantized coordinates and the sizes of the rings, polygons and features
+def _quantize(collection, translate, scale):
+    coordinates, rings, polygons, features = [], [], [], []
+    for feature in collection["features"]:
+        feature_polygons = _polygons(feature["geometry"])
+        features.append(len(feature_polygons))
+        for polygon in feature_polygons:
+            polygons.append(len(polygon))
+            for ring in polygon:
+                points = np.round((np.asarray(ring[:-1]) - translate) / scale).astype(np.int32)
+                # Drop the points that fall on the same grid cell as the previous one
+                points = points[np.r_[True, np.any(np.diff(points, axis=0) != 0, axis=1)]]
+                coordinates.append(points)
+                rings.append(len(points))
+    return (np.vstack(coordinates), np.array(rings, dtype=np.int32), np.array(polygons, dtype=np.int32),
+            np.array(features, dtype=np.int32))
+
+
+def _build_cache(path, geojson_path):
+    geojson = load_geojson(geojson_path)
+    topology = CountyTopology(geojson)
+    scale = 10.0 ** -PRECISION
+    translate = np.floor(np.vstack(topology.rings).min(axis=0) / scale) * scale
+
+    arrays = {"names": np.array(topology.names, dtype=str), "translate": translate, "scale": np.array(scale)}
+    for level, tolerance in TOLERANCES.items():
+        coordinates, rings, polygons, features = _quantize(topology.simplified(tolerance), translate, scale)
+        arrays.update({f"coordinates_{level}": coordinates, f"rings_{level}": rings,
+                       f"polygons_{level}": polygons, f"features_{level}": features})
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npz")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+# Delta encoded JSON asset for one level of detail
+def _encode_level(arrays, level):
+    coordinates = arrays[f"coordinates_{level}"]
+    ring_ends = np.cumsum(arrays[f"rings_{level}"])
+    deltas = coordinates.copy()
+    deltas[1:] -= coordinates[:-1]
+    # The first point of every ring is stored as is
+    starts = np.r_[0, ring_ends[:-1]]
+    deltas[starts] = coordinates[starts]
+
+    rings = [ring.ravel().tolist() for ring in np.split(deltas, ring_ends[:-1])]
+    polygon_ends = np.cumsum(arrays[f"polygons_{level}"])
+    polygons = [rings[start:stop] for start, stop in zip(np.r_[0, polygon_ends[:-1]], polygon_ends)]
+    feature_ends = np.cumsum(arrays[f"features_{level}"])
+    features = [polygons[start:stop] for start, stop in zip(np.r_[0, feature_ends[:-1]], feature_ends)]
+
+    return json.dumps({"names": arrays["names"].tolist(), "scale": float(arrays["scale"]),
+                       "translate": arrays["translate"].tolist(), "features": features},
+                      separators=(",", ":")).encode()
+
+
+# County names and the encoded asset of every level of detail, loaded once per process
+@functools.lru_cache(maxsize=None)
+def load_encoded_levels(geojson_path=GEOJSON_PATH):
+    key = file_digest(geojson_path, extra=json.dumps([TOLERANCES, PRECISION, MAX_GAP]))
+    path = os.path.join(GEOMETRY_CACHE_DIR, f"{key}.npz")
+    if not os.path.exists(path):
+        _build_cache(path, geojson_path)
+    with np.load(path) as arrays:
+        arrays = dict(arrays)
+    return arrays["names"].tolist(), {level: _encode_level(arrays, level) for level in TOLERANCES}
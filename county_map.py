@@ -0,0 +1,172 @@
+# Import the necessary packages
+import gzip
+import hashlib
+import plotly.graph_objects as go
+from dash import Dash, dcc, html, Input, Output
+from flask import Response, abort, request
+from county_geometry import LEVEL_MIN_SCALES, join_index, load_encoded_levels
+from callback_metrics import instrument, phase
+from census_etl import census_wide, load_census
+
+# Kenya 2019 census: percentage of conventional households by main mode of human waste disposal in each county, as
+# converted by `census_etl.py`
+df = census_wide(load_census())
+methods = [column for column in df.columns if column not in ('County', 'Conventional Households')]
+
+# County boundaries from `mygeodata/County.json`, simplified at several levels of detail and encoded as compact JSON
+# assets (see `county_geometry.py`). The browser downloads each level once; the callbacks only send values
+geometry_names, geometry_assets = load_encoded_levels()
+
+# Census county name -> `Name` of the county in the GeoJSON, e.g. "ELGEYO/MARAKWET" -> "Elgeyo Marakwet"
+county_names = join_index(df['County'], geometry_names)
+
+# Percentage of households for every disposal method, in the order of the counties in the geometry assets
+county_values = df.set_index(df['County'].map(county_names))[methods].reindex(geometry_names)
+
+app = Dash(__name__)
+server = app.server
+
+# Phase timing of the callbacks at /metrics when DASH_CALLBACK_METRICS=1, see `callback_metrics.py`
+instrument(app)
+
+# ETag and gzip-compressed copy of every geometry asset, computed once
+geometry_etags = {level: hashlib.sha1(asset).hexdigest() for level, asset in geometry_assets.items()}
+geometry_gzip = {level: gzip.compress(asset) for level, asset in geometry_assets.items()}
+
+# Serve the geometry assets with ETags, so browsers keep them and revalidate with a 304 response. The route follows the
+# app's routes_pathname_prefix, like the URL the browser fetches follows its requests_pathname_prefix
+@server.route(f'{app.config.routes_pathname_prefix}county-geometry/<int:level>.json')
+def county_geometry_asset(level):
+    if level not in geometry_assets:
+        abort(404)
+
+    if 'gzip' in request.accept_encodings:
+        response = Response(geometry_gzip[level], mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(geometry_etags[level] + '-gz')
+    else:
+        response = Response(geometry_assets[level], mimetype='application/json')
+        response.set_etag(geometry_etags[level])
+
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response.make_conditional(request)
+
+# Layout of the map without any data. It is sent once with the app layout and reused by every redraw in the browser
+base_layout = go.Figure().update_geos(fitbounds='locations', visible=False).update_layout(
+    margin={'r': 0, 'l': 0, 'b': 0}, uirevision='county-map').to_plotly_json()['layout']
+
+app.layout = html.Div([
+    html.H2("Map of human waste disposal methods across counties (Kenya 2019 census)"),
+
+    html.Hr(),
+
+    # Dropdown to select the human waste disposal method
+    dcc.Dropdown(methods, 'Pit latrine covered', id='method-dropdown', clearable=False),
+
+    # The county choropleth
+    dcc.Graph(id='county-map', style={'height': '80vh'}),
+
+    # Values of the selected disposal method, the level of detail for the current zoom and the layout of the map
+    dcc.Store(id='county-map-values'),
+    dcc.Store(id='county-map-level', data=0),
+    dcc.Store(id='county-map-layout', data=base_layout),
+])
+
+# Send only the values of the selected disposal method, one per county of the geometry
+@app.callback(
+    Output('county-map-values', 'data'),
+    Input('method-dropdown', 'value'),
+)
+def update_values(method):
+    values = county_values[method]
+    # The values are the figure of this map, the browser only combines them with the geometry
+    with phase('figure'):
+        z = values.astype(object).where(values.notna(), None).tolist()
+    return {'method': method, 'z': z}
+
+# Pick the level of detail from the zoom of the map, in the browser
+app.clientside_callback(
+    """
+    function(relayoutData, currentLevel) {
+        var scale = relayoutData && relayoutData['geo.projection.scale'];
+        if (scale === undefined) {
+            return window.dash_clientside.no_update;
+        }
+        var minScales = %s;
+        var level = 0;
+        for (var key in minScales) {
+            if (scale >= minScales[key]) {
+                level = Math.max(level, Number(key));
+            }
+        }
+        return level === currentLevel ? window.dash_clientside.no_update : level;
+    }
+    """ % {str(level): scale for level, scale in LEVEL_MIN_SCALES.items()},
+    Output('county-map-level', 'data'),
+    Input('county-map', 'relayoutData'),
+    Input('county-map-level', 'data'),
+)
+
+# Draw the map in the browser. The geometry of each level is fetched and decoded once per page, then every redraw
+# only combines it with the values sent by `update_values`
+app.clientside_callback(
+    """
+    function(values, level, layout) {
+        if (!values) {
+            return window.dash_clientside.no_update;
+        }
+
+        function decode(asset) {
+            var features = asset.features.map(function (polygons, i) {
+                var coordinates = polygons.map(function (rings) {
+                    return rings.map(function (ring) {
+                        var points = [], x = 0, y = 0;
+                        for (var j = 0; j < ring.length; j += 2) {
+                            x += ring[j];
+                            y += ring[j + 1];
+                            points.push([asset.translate[0] + x * asset.scale, asset.translate[1] + y * asset.scale]);
+                        }
+                        points.push(points[0]);
+                        return points;
+                    });
+                });
+                return {type: 'Feature', properties: {Name: asset.names[i]},
+                        geometry: {type: 'MultiPolygon', coordinates: coordinates}};
+            });
+            return {names: asset.names, geojson: {type: 'FeatureCollection', features: features}};
+        }
+
+        var cache = window.countyGeometry = window.countyGeometry || {};
+        if (!cache[level]) {
+            cache[level] = fetch('%s' + level + '.json')
+                .then(function (response) { return response.json(); })
+                .then(decode);
+        }
+
+        return cache[level].then(function (geometry) {
+            var trace = {
+                type: 'choropleth',
+                geojson: geometry.geojson,
+                featureidkey: 'properties.Name',
+                locations: geometry.names,
+                z: values.z,
+                hovertext: geometry.names,
+                hovertemplate: '<b>%%{hovertext}</b><br>' + values.method + ': %%{z}%%<extra></extra>',
+                colorscale: 'Viridis',
+                colorbar: {title: {text: '%% of households'}}
+            };
+            var title = {text: 'Percentage of conventional households using: ' + values.method};
+            return {data: [trace], layout: Object.assign({}, layout, {title: title})};
+        });
+    }
+    """ % app.get_relative_path('/county-geometry/'),
+    Output('county-map', 'figure'),
+    Input('county-map-values', 'data'),
+    Input('county-map-level', 'data'),
+    Input('county-map-layout', 'data'),
+)
+
+if __name__ == '__main__':
+    app.run_server(debug=True)
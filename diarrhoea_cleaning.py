@@ -2,9 +2,14 @@
 import pandas as pd
 import numpy as np
 import plotly.express as px
-from dash import Dash, dcc, html, Input, Output
+import plotly.graph_objects as go
+from dash import Dash, dcc, html, Input, Output, State
 import json
 import time
+from diarrhoea_etl import load_cleaned
+from compression import install_compression
+from warmup import install_warmup
+from callback_metrics import instrument, phase
 
 styles = {
     'pre': {
@@ -16,39 +21,167 @@ styles = {
 # Source of the data used is: https://ourworldindata.org/childhood-diarrheal-diseases?utm_source=pocket_saves
 # from the download section of compound line graph
 
-# Clean the dataset for: "D:\gachuhi\dash-projects\dash-layout\data\diarrhoea_children_gdp.csv"
-# Specifically the CSV file: "diarrhoea_children_gdp.csv"
+# The dataset is cleaned ahead of time by `diarrhoea_etl.py` (rows without deaths or population removed and countries
+# joined to their sub-regions from a vendored ISO-3166 table). Here we only load the cleaned artifact, so starting the
+# app needs no network access. Run `python diarrhoea_etl.py` after updating "data/diarrhoea_children_gdp.csv"
+df = load_cleaned()
+
+# The artifact keeps short names for the measures (see `DIARRHOEA_SCHEMA` in `schema.py`), the charts show the
+# names of the source
+LABELS = {
+    "Deaths": "Deaths",
+    "GDP per capita": "GDP per capita, PPP (constant 2017 international $)",
+    "Population": "Population (historical estimates)",
+}
+
+# The charts of a clicked country. They are drawn once here for a sample country to get the settings of their traces
+# and layouts (see `drilldown_templates`), the browser fills in the data of the clicked country
+def population_figure(dff, country_name):
+    fig = px.line(dff, x="Year", y="Population", markers=True, labels=LABELS)
+    fig.update_layout(title={"text": population_title(dff, country_name)})
+    return fig
+
 
-# Remove all rows that have null values in the column: "Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)"
-# and "Population (historical estimates)"
+def gdp_figure(dff, country_name):
+    fig = px.line(dff, x="Year", y="GDP per capita", markers=True,
+                  labels={**LABELS, "GDP per capita": "GDP per Capita"})
+    fig.update_layout(title={"text": gdp_title(dff, country_name)})
+    return fig
+
+
+def deaths_figure(dff, country_name):
+    fig = px.bar(dff, x="Year", y="Deaths",
+                 hover_data=["GDP per capita", "Population", "sub-region"],
+                 labels=LABELS, color="Deaths")
+    fig.update_layout(title={"text": deaths_title(dff, country_name)})
+    return fig
 
-df = pd.read_csv("data/diarrhoea_children_gdp.csv")
-# print(df)
 
-# Now remove all null values in the column: "Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)" and
-# "Population (historical estimates)"
-# df = df.copy()
-df = df.dropna(
-    subset=["Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)", "Population (historical estimates)"])
-# print(df)
+def population_title(dff, country_name):
+    return (f"Population (historical estimates) for {country_name}" + "<br>" +
+            f"({dff['Year'].min()} - {dff['Year'].max()})")
 
-# The below dataset contains country codes and their continents. We want to join the countries in our diarrhoea dataset
-# to their sub-regions since the `continent` column in our diarrhoea dataset has missing values
-df_code = pd.read_csv("https://raw.githubusercontent.com/lukes/ISO-3166-Countries-with-Regional-Codes/master/all/all.csv")
-df_code["Code"] = df_code["alpha-3"]
 
-df = pd.merge(df, df_code[["Code", "sub-region"]], on="Code", how="left") # Merge with country `Code` to their continents
+def gdp_title(dff, country_name):
+    return (f"GDP per capita, PPP (constant 2017 international $)" + "<br>" +
+            f"for {country_name} ({dff['Year'].min()} - {dff['Year'].max()})")
 
-# Remove all rows with value `None` in column `sub-region`
-df = df.dropna(subset=["sub-region"])
 
-# Save the cleaned dataframe
-# df.to_csv("data/cleaned_df2.csv")
+def deaths_title(dff, country_name):
+    return (f"Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)" + "<br>" +
+            f"for {country_name} ({dff['Year'].min()} - {dff['Year'].max()})")
+
+
+# The trace settings and layout of each chart, without the data of any country
+def chart_templates(dff, country_name):
+    templates = {}
+    for name, figure in (("population", population_figure), ("gdp", gdp_figure), ("deaths", deaths_figure)):
+        fig = json.loads(figure(dff, country_name).to_json())
+        trace = {key: value for key, value in fig["data"][0].items() if key not in ("x", "y", "customdata")}
+        if name == "deaths":
+            # The bars are colored by the deaths of the country
+            trace["marker"] = {key: value for key, value in trace["marker"].items() if key != "color"}
+        templates[name] = {"trace": trace,
+                           "layout": {key: value for key, value in fig["layout"].items() if key != "title"}}
+    return templates
+
+
+# Everything the charts of one country need, in a compact form: one list per measure, in the order of the years
+def country_bundle(country_name, dff):
+    def values(column):
+        return [None if np.isnan(value) else value for value in dff[column].astype(float).tolist()]
+
+    return {
+        "years": dff["Year"].astype(int).tolist(),
+        "population": dff["Population"].astype("int64").tolist(),
+        "gdp": values("GDP per capita"),
+        "deaths": values("Deaths"),
+        "sub_region": str(dff["sub-region"].iloc[0]) if len(dff) else None,
+        "titles": {"population": population_title(dff, country_name), "gdp": gdp_title(dff, country_name),
+                   "deaths": deaths_title(dff, country_name)},
+    }
+
+
+# The bundle of every country, grouped once: a click is then a dictionary lookup instead of a scan of the frame
+series = {country: country_bundle(country, dff)
+          for country, dff in df.sort_values(["Entity", "Year"]).groupby("Entity", observed=True, sort=False)}
+
+drilldown_templates = chart_templates(df[df["Entity"] == "Kenya"].sort_values(by="Year"), "Kenya")
+
+# What the slider charts need for every year, built once at start so that moving the slider only looks values up:
+#
+# - `rows(year)`: the rows of the year, one contiguous block of a frame sorted by year
+# - `midpoints`: the GDP weighted mean of the deaths, the midpoint of the treemap colors
+# - `treemaps`: the nodes of the treemap, the countries followed by their sub-regions, as `go.Treemap` takes them
+class YearCube:
+    def __init__(self, df):
+        self.frame = df.sort_values("Year", kind="stable").reset_index(drop=True)
+        years = self.frame["Year"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, np.diff(years) != 0])
+        stops = np.r_[starts[1:], len(years)]
+        self.ranges = {int(years[start]): (start, stop) for start, stop in zip(starts, stops)}
+
+        self.midpoints, self.treemaps = {}, {}
+        for year in self.ranges:
+            rows = self.rows(year)
+            self.midpoints[year] = weighted_midpoint(rows["Deaths"], rows["GDP per capita"])
+            self.treemaps[year] = treemap_nodes(rows)
+
+    def rows(self, year):
+        start, stop = self.ranges.get(year, (0, 0))
+        return self.frame.iloc[start:stop]
+
+
+# Mean of `values` weighted by `weights`, over the rows that have both (some countries have no GDP per capita)
+def weighted_midpoint(values, weights):
+    values, weights = values.to_numpy(dtype=float), weights.to_numpy(dtype=float)
+    valid = ~(np.isnan(values) | np.isnan(weights))
+    if not weights[valid].sum():
+        return None
+    return float(np.average(values[valid], weights=weights[valid]))
+
+
+# Nodes of the sub-region -> country treemap of one year. A sub-region has the sum of the deaths of its countries and,
+# like `px.treemap` colors it, their mean weighted by the deaths: sum(deaths²) / sum(deaths)
+def treemap_nodes(rows):
+    deaths = rows["Deaths"].to_numpy(dtype=float)
+    gdp = rows["GDP per capita"].to_numpy()
+    countries = rows["Entity"].astype(str).to_numpy()
+    regions = rows["sub-region"].astype(str).to_numpy()
+
+    codes, names = pd.factorize(regions)
+    totals = np.bincount(codes, weights=deaths, minlength=len(names))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        colors = np.bincount(codes, weights=deaths ** 2, minlength=len(names)) / totals
+
+    # The GDP per capita of a sub-region is only shown when all its countries have the same
+    region_gdp = []
+    for code in range(len(names)):
+        values = pd.unique(gdp[codes == code])
+        region_gdp.append(str(values[0]) if len(values) == 1 else "(?)")
+
+    return {
+        "ids": np.r_[np.char.add(np.char.add(regions, "/"), countries), names],
+        "labels": np.r_[countries, names],
+        "parents": np.r_[regions, np.full(len(names), "")],
+        "values": np.r_[deaths, totals],
+        "colors": np.r_[deaths, colors],
+        "gdp": np.r_[gdp.astype(str), region_gdp],
+    }
+
+
+cube = YearCube(df)
 
 # Now to create the plotly dashboard
 app = Dash(__name__)
 server = app.server
 
+# Phase timing of the callbacks at /metrics when DASH_CALLBACK_METRICS=1, see `callback_metrics.py`
+instrument(app)
+
+# Compress the callback responses and keep them for repeated selections, see `compression.py`
+compression = install_compression(app)
+
 # Create the layout
 app.layout = html.Div([
 
@@ -99,6 +232,10 @@ app.layout = html.Div([
     # 5 Draw bar graph of diarrhoea related deaths across the years
     dcc.Graph(id="diarrhoea-bar-graph"),
 
+    # The series of the clicked country, and the chart settings the browser draws them with
+    dcc.Store(id="country-series"),
+    dcc.Store(id="drilldown-templates", data=drilldown_templates),
+
     # 4 The scatterplot and heatmap on the same column
     html.Div([
         dcc.Graph(id="scatterplot-death-gdp-year"),
@@ -114,16 +251,15 @@ app.layout = html.Div([
     Input("year-slider", "value")
 )
 def update_map(year_slider):
-    dff = df[df["Year"] == year_slider]
+    dff = cube.rows(year_slider)
 
     fig = px.choropleth(dff, locations="Entity", locationmode="country names",
-                        color="Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)",
+                        color="Deaths",
                         hover_name="Year",
                         color_continuous_scale=px.colors.sequential.Plasma,
                         title=f"Map showing deaths from diarrhoeal diseases for children <5 years in {year_slider}",
                         custom_data=["Entity"],
-                        labels={
-                            "Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)": "Deaths"})
+                        labels=LABELS)
 
     fig.update_layout(transition={"easing": "elastic-out"})
 
@@ -138,79 +274,49 @@ def update_map(year_slider):
 #
 # #####
 
-# 1 Callback for line graph for population against years
+# 1-3 One request per click: the server sends the series of the clicked country into the `country-series` store and
+# the browser draws the population, GDP per capita and deaths charts from it with the templates
 @app.callback(
-    Output("line-graph-population", "figure"),
+    Output("country-series", "data"),
     Input("map-year", "clickData")
 )
-def line_population(clickData):
+def drilldown(clickData):
     if clickData is None:
         country_name = "Kenya"
     else:
         country_name = clickData["points"][0]["customdata"][0]
 
-    dff = df[df["Entity"] == country_name]
-    dff = dff.sort_values(by="Year")
-    #
-    fig = px.line(dff, x="Year", y="Population (historical estimates)", markers=True,
-                  )
-    #
-    fig.update_layout(
-        title={"text": f"Population (historical estimates) for {country_name}" + "<br>" +
-                       f"({dff['Year'].min()} - {dff['Year'].max()})"}
-    )
-    #
-    return fig
-
-# 2 Callback for line graph for gdp-per-capita against years
-@app.callback(
+    return series.get(country_name) or country_bundle(country_name, df.iloc[:0])
+
+app.clientside_callback(
+    """
+    function(series, templates) {
+        if (!series) {
+            return [window.dash_clientside.no_update, window.dash_clientside.no_update,
+                    window.dash_clientside.no_update];
+        }
+        function figure(name, data) {
+            var template = templates[name];
+            return {data: [Object.assign({}, template.trace, data)],
+                    layout: Object.assign({}, template.layout, {title: {text: series.titles[name]}})};
+        }
+        var customdata = series.years.map(function (year, i) {
+            return [series.gdp[i], series.population[i], series.sub_region];
+        });
+        return [
+            figure("population", {x: series.years, y: series.population}),
+            figure("gdp", {x: series.years, y: series.gdp}),
+            figure("deaths", {x: series.years, y: series.deaths, customdata: customdata,
+                              marker: Object.assign({}, templates.deaths.trace.marker, {color: series.deaths})})
+        ];
+    }
+    """,
+    Output("line-graph-population", "figure"),
     Output("line-graph-gdp-capita", "figure"),
-    Input("map-year", "clickData")
-)
-def line_capita(clickData):
-    if clickData is None:
-        country_name = "Kenya"
-    else:
-        country_name = clickData["points"][0]["customdata"][0]
-
-    dff = df[df["Entity"] == country_name]
-    dff = dff.sort_values(by="Year")
-
-    fig = px.line(dff, x="Year", y="GDP per capita, PPP (constant 2017 international $)", markers=True,
-                  labels={"GDP per capita, PPP (constant 2017 international $)": "GDP per Capita"})
-
-    fig.update_layout(
-        title={
-            "text": f"GDP per capita, PPP (constant 2017 international $)" + "<br>" +
-                    f"for {country_name} ({dff['Year'].min()} - {dff['Year'].max()})"}
-    )
-
-    return fig
-
-# 3 Callbacks to draw bar graph for diarrhoea related deaths
-@app.callback(
     Output("diarrhoea-bar-graph", "figure"),
-    Input("map-year", "clickData")
+    Input("country-series", "data"),
+    State("drilldown-templates", "data")
 )
-def update_bar_graph(clickData):
-    if clickData is None:
-        country_name = "Kenya"
-    else:
-        country_name = clickData["points"][0]["location"]
-
-    dff = df[df["Entity"] == country_name]
-    dff = dff.sort_values(by="Year")
-
-    fig = px.bar(dff, x="Year", y="Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)",
-                 hover_data=["GDP per capita, PPP (constant 2017 international $)", "Population (historical estimates)",
-                             "sub-region"],
-                 labels={"Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)": "Deaths"},
-                 color="Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)")
-
-    fig.update_layout(title={"text": f"Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)" + "<br>" +
-                                     f"for {country_name} ({dff['Year'].min()} - {dff['Year'].max()})"})
-
-    return fig
 
 # 4.1 Scatterplot callback
 @app.callback(
@@ -218,16 +324,15 @@ def update_bar_graph(clickData):
     Input("year-slider", "value")
 )
 def update_scatterplot(year_slider):
-    dff = df[df["Year"] == year_slider]
+    dff = cube.rows(year_slider)
 
-    fig = px.scatter(dff, x="GDP per capita, PPP (constant 2017 international $)",
-                     y="Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)",
+    fig = px.scatter(dff, x="GDP per capita", y="Deaths",
                      color="sub-region",
-                     size="Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)",
+                     size="Deaths",
                      hover_data="Entity",
                      title=f"Scatterplot showing Deaths from Diarrhoea cases against GDP per capita," + "<br>" +
                            f"PPP (constant 2017 international $ for {year_slider}",
-                     labels={"Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)": "Deaths"})
+                     labels=LABELS)
 
     # fig.update_traces(marker_size=10)
 
@@ -242,26 +347,35 @@ def update_scatterplot(year_slider):
     Input("year-slider", "value")
 )
 def update_heatmap(year_slider):
-    dff = df[df["Year"] == year_slider]
-
-    fig = px.treemap(dff, names="Entity", path=["sub-region", "Entity"],
-                     values="Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)",
-                     color="Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)", hover_name="Year",
-                     hover_data="GDP per capita, PPP (constant 2017 international $)",
-                     color_continuous_scale=px.colors.sequential.Plasma,
-                     color_continuous_midpoint=np.average(
-                         dff["Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)"],
-                         weights=dff["GDP per capita, PPP (constant 2017 international $)"]),
-                     title=f"Treemap Chart showing deaths from diarrhoeal diseases" + "<br>" +
-                           f"for children <5 years in {year_slider}",
-                     labels={"Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)": "Deaths"})
-
-    fig.update_layout(transition={"easing": "elastic-out",
-                                  "duration": 50},
-                      margin={"t": 50, "l": 25, "r": 25, "b": 25})
+    nodes = cube.treemaps.get(year_slider) or treemap_nodes(cube.rows(year_slider))
+
+    with phase("figure"):
+        # The trace `px.treemap(path=["sub-region", "Entity"], values="Deaths", color="Deaths")` draws, from the nodes
+        # of the year instead of aggregating the rows again
+        fig = go.Figure(go.Treemap(
+            ids=nodes["ids"], labels=nodes["labels"], parents=nodes["parents"], values=nodes["values"],
+            branchvalues="total", name="",
+            marker={"colors": nodes["colors"], "coloraxis": "coloraxis"},
+            customdata=np.column_stack([nodes["gdp"], nodes["colors"]]).astype(object),
+            hovertext=np.full(len(nodes["ids"]), str(year_slider)),
+            hovertemplate="<b>%{hovertext}</b><br><br>labels=%{label}<br>Deaths_sum=%{value}<br>parent=%{parent}<br>"
+                          f"id=%{{id}}<br>{LABELS['GDP per capita']}=%{{customdata[0]}}<br>Deaths=%{{color}}"
+                          "<extra></extra>"))
+
+        fig.update_layout(coloraxis={"colorscale": px.colors.sequential.Plasma, "cmid": cube.midpoints.get(year_slider),
+                                     "colorbar": {"title": {"text": "Deaths"}}},
+                          legend={"tracegroupgap": 0},
+                          title={"text": f"Treemap Chart showing deaths from diarrhoeal diseases" + "<br>" +
+                                         f"for children <5 years in {year_slider}"},
+                          transition={"easing": "elastic-out",
+                                      "duration": 50},
+                          margin={"t": 50, "l": 25, "r": 25, "b": 25})
 
     return fig
 
+# Render the default view and the most requested selections into the response cache at start, see `warmup.py`
+warmup = install_warmup(app, compression, "diarrhoea_cleaning")
+
 if __name__ == "__main__":
     app.run(debug=True)
 
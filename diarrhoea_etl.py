@@ -0,0 +1,98 @@
+# Ahead-of-time cleaning of the diarrhoea dataset used by `diarrhoea_cleaning.py`.
+#
+# Source of the data used is: https://ourworldindata.org/childhood-diarrheal-diseases?utm_source=pocket_saves
+# from the download section of compound line graph
+#
+# Run `python diarrhoea_etl.py` after changing `data/diarrhoea_children_gdp.csv`. It writes a typed columnar artifact
+# (one .npy file per column, see `columnar_cache.py`) that the dashboard only has to load, so starting the dashboard
+# needs no network access and does no cleaning work.
+import argparse
+import os
+
+import pandas as pd
+
+from columnar_cache import file_digest, load_frame, read_meta, save_frame
+from schema import DIARRHOEA_SCHEMA
+
+SOURCE_CSV = "data/diarrhoea_children_gdp.csv"
+
+# Country codes and their sub-regions, vendored so that the build works offline. The vendored file is not the upstream
+# ISO-3166 table: it holds the 204 distinct (Entity, Code, sub-region) rows of `data/cleaned_df2.csv`, i.e. the pairs
+# that the merge with the upstream table produced for this dataset, with the OWID country names (e.g. "Micronesia
+# (country)") in its `name` column. Only `alpha-3` and `sub-region` are used. `python diarrhoea_etl.py
+# --refresh-regions` replaces it with the `name`, `alpha-3` and `sub-region` columns of the upstream table at
+# REGIONS_URL, which also lists countries that are not in the dataset
+REGIONS_CSV = "data/iso3166_sub_regions.csv"
+REGIONS_URL = "https://raw.githubusercontent.com/lukes/ISO-3166-Countries-with-Regional-Codes/master/all/all.csv"
+
+# Bump this whenever the cleaning below changes; the version is part of the artifact directory name
+ARTIFACT_VERSION = 2
+ARTIFACT_DIR = f"data/diarrhoea_cleaned_v{ARTIFACT_VERSION}"
+
+DEATHS = "Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)"
+POPULATION = "Population (historical estimates)"
+
+
+def refresh_regions():
+    df_code = pd.read_csv(REGIONS_URL)
+    df_code[["name", "alpha-3", "sub-region"]].to_csv(REGIONS_CSV, index=False)
+
+
+def clean(df, df_code):
+    # Remove all rows that have null values in the column: "Deaths - Diarrheal diseases - Sex: Both - Age: Under 5
+    # (Rate)" and "Population (historical estimates)"
+    df = df.dropna(subset=[DEATHS, POPULATION])
+
+    # Join the countries to their sub-regions since the `continent` column in our diarrhoea dataset has missing values
+    df_code = df_code.rename(columns={"alpha-3": "Code"})
+    df = pd.merge(df, df_code[["Code", "sub-region"]], on="Code", how="left")
+
+    # Remove all rows with value `None` in column `sub-region`
+    df = df.dropna(subset=["sub-region"]).reset_index(drop=True)
+
+    df["Year"] = df["Year"].astype("int16")
+    return df
+
+
+def build(source=SOURCE_CSV, regions=REGIONS_CSV, target=ARTIFACT_DIR):
+    # Only the columns used by the dashboard, with compact types and short names (see `schema.py`)
+    df = DIARRHOEA_SCHEMA.apply(clean(pd.read_csv(source), pd.read_csv(regions)))
+    save_frame(df, target, extra_meta={"artifact_version": ARTIFACT_VERSION, "source": source,
+                                       "source_digest": file_digest(source), "regions_digest": file_digest(regions)})
+    return df
+
+
+# Load the cleaned dataset. The artifact is built here only if it was never built in this checkout
+def load_cleaned(target=ARTIFACT_DIR):
+    if not os.path.exists(os.path.join(target, "meta.json")):
+        print(f"{target} not found, building it from {SOURCE_CSV}")
+        build(target=target)
+    # The measures are stored as float32 and handed out as the float64 numbers of the source file
+    return DIARRHOEA_SCHEMA.widen(load_frame(target))
+
+
+# Whether the artifact was built from the current source and region files
+def is_current(target=ARTIFACT_DIR):
+    try:
+        meta = read_meta(target)
+    except OSError:
+        return False
+    return (meta.get("artifact_version") == ARTIFACT_VERSION
+            and meta.get("source_digest") == file_digest(SOURCE_CSV)
+            and meta.get("regions_digest") == file_digest(REGIONS_CSV))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the cleaned diarrhoea dataset used by diarrhoea_cleaning.py")
+    parser.add_argument("--refresh-regions", action="store_true",
+                        help=f"download the region table again from {REGIONS_URL}")
+    parser.add_argument("--check", action="store_true", help="only report whether the artifact is up to date")
+    args = parser.parse_args()
+
+    if args.check:
+        print("up to date" if is_current() else "out of date")
+        raise SystemExit(0 if is_current() else 1)
+    if args.refresh_regions:
+        refresh_regions()
+    df = build()
+    print(f"Wrote {len(df)} rows to {ARTIFACT_DIR}")
@@ -0,0 +1,160 @@
+# Dataset downloads served straight from the Flask server.
+#
+# `dcc.send_data_frame(df.to_csv, ...)` writes the whole dataframe to a string, base64 encodes it into the JSON
+# response of a callback and keeps all of that in the worker's memory. Every click does this again. Here the download
+# buttons are plain links to a route on the server instead:
+#
+#   /download/<dataset>.<format>?country=Kenya&country=Uganda&residence=Total&year=2010
+#
+# - Without a selection, the export of the whole dataset is built once and served from cached bytes. `prebuild` builds
+#   them before the first download, the apps call it along with the warm-up of `warmup.py`.
+# - With a selection, only the matching rows are written. CSV is streamed in chunks, compressed on the fly for gzip.
+# - Formats: "csv", "csv.gz", "npz" (one numpy array per column) and "parquet" when pyarrow is installed.
+import importlib.util
+import io
+import threading
+import zlib
+from urllib.parse import urlencode
+
+import numpy as np
+from flask import Response, abort, request
+
+from trace_cache import LRUCache
+
+CHUNK_ROWS = 5000
+
+# Whole-dataset exports kept by each `DatasetDownloads`, one per dataset and format
+EXPORT_CACHE_SIZE = 8
+
+FORMATS = {
+    "csv": "text/csv",
+    "csv.gz": "application/gzip",
+    "npz": "application/octet-stream",
+}
+if importlib.util.find_spec("pyarrow") is not None:
+    FORMATS["parquet"] = "application/vnd.apache.parquet"
+
+DOWNLOAD_FORMAT_LABELS = {"csv": "CSV", "csv.gz": "CSV (gzip)", "npz": "NumPy columns (.npz)", "parquet": "Parquet"}
+
+# Query parameter -> column of the WHO datasets it filters on
+SELECTION_COLUMNS = {"country": "Country", "residence": "Residence Area Type", "year": "Year"}
+
+
+def _csv_chunks(df):
+    for start in range(0, max(len(df), 1), CHUNK_ROWS):
+        yield df.iloc[start:start + CHUNK_ROWS].to_csv(header=start == 0).encode()
+
+
+def _gzip_chunks(chunks):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _npz_bytes(df):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **{str(column): (values.to_numpy() if values.dtype.kind in "biufM"
+                                                 else values.astype(object).fillna("").to_numpy(dtype=str))
+                                   for column, values in df.items()})
+    return buffer.getvalue()
+
+
+def _parquet_bytes(df):
+    buffer = io.BytesIO()
+    df.to_parquet(buffer)
+    return buffer.getvalue()
+
+
+# Whole file content of `df` in `fmt`
+def export_bytes(df, fmt):
+    if fmt == "csv":
+        return b"".join(_csv_chunks(df))
+    if fmt == "csv.gz":
+        return b"".join(_gzip_chunks(_csv_chunks(df)))
+    if fmt == "npz":
+        return _npz_bytes(df)
+    return _parquet_bytes(df)
+
+
+class DatasetDownloads:
+    # `datasets` maps a dataset name to its dataframe (any object with `[name]` access works, so datasets can be
+    # loaded lazily) and `filenames` maps it to the file name offered to the browser, without extension. An app whose
+    # data can change while it runs passes a `version` function returning the current version of the data, like for
+    # `install_compression`: the cached exports are dropped when it changes
+    def __init__(self, app, datasets, filenames, route="download", cache_size=EXPORT_CACHE_SIZE, version=None):
+        self.app = app
+        self.datasets = datasets
+        self.filenames = filenames
+        self.route = route
+        self.version = version
+        self.exports = LRUCache(cache_size)
+        self._export_version = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        app.server.add_url_rule(f"{app.config.routes_pathname_prefix}{route}/<filename>",
+                                endpoint=f"{route}_dataset", view_func=self.view)
+
+    # Cached export of a whole dataset, built on the first request for it. Only the version check holds the lock, the
+    # export is built outside of it so that a slow build does not hold up the other downloads. The key counts the
+    # versions seen: an export of older data that finishes after the check is never served
+    def full_export(self, name, fmt):
+        with self._lock:
+            if self.version is not None:
+                version = self.version()
+                if version != self._export_version:
+                    self.clear()
+                    self._export_version = version
+                    self._generation += 1
+            key = (self._generation, name, fmt)
+        return self.exports.get_or_build(key, lambda: export_bytes(self.datasets[name], fmt))
+
+    # Build the exports of every dataset in `formats` before the first download asks for them
+    def prebuild(self, formats=("csv",)):
+        for name in self.filenames:
+            for fmt in formats:
+                self.full_export(name, fmt)
+
+    def clear(self):
+        self.exports.clear()
+
+    # Link to the download of `name` in `fmt`, limited to the given selection (None or empty means everything)
+    def url(self, name, fmt="csv", **selection):
+        params = [(key, value) for key, values in selection.items() if values not in (None, [], "")
+                  for value in (values if isinstance(values, (list, tuple)) else [values])]
+        path = self.app.get_relative_path(f"/{self.route}/{name}.{fmt}")
+        return f"{path}?{urlencode(params)}" if params else path
+
+    def _selected(self, df):
+        mask = None
+        for key, column in SELECTION_COLUMNS.items():
+            values = request.args.getlist(key)
+            if not values:
+                continue
+            if df[column].dtype.kind in "iuf":
+                values = [float(value) for value in values]
+            column_mask = df[column].isin(values).to_numpy()
+            mask = column_mask if mask is None else mask & column_mask
+        return df if mask is None else df[mask]
+
+    def view(self, filename):
+        name, _, fmt = filename.partition(".")
+        if name not in self.filenames or fmt not in FORMATS:
+            abort(404)
+
+        headers = {"Content-Disposition": f"attachment; filename={self.filenames[name]}.{fmt}"}
+        if not any(key in request.args for key in SELECTION_COLUMNS):
+            return Response(self.full_export(name, fmt), mimetype=FORMATS[fmt], headers=headers)
+
+        try:
+            df = self._selected(self.datasets[name])
+        except ValueError:
+            abort(400)
+        if fmt == "csv":
+            return Response(_csv_chunks(df), mimetype=FORMATS[fmt], headers=headers)
+        if fmt == "csv.gz":
+            return Response(_gzip_chunks(_csv_chunks(df)), mimetype=FORMATS[fmt], headers=headers)
+        return Response(export_bytes(df, fmt), mimetype=FORMATS[fmt], headers=headers)
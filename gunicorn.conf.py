@@ -0,0 +1,36 @@
+# gunicorn settings for the dashboards, picked up from the working directory, e.g. `gunicorn sanitation_map:server`.
+#
+# Two ways keep memory from being copied into every worker; both are on by default and measured by
+# `benchmarks/worker_memory.py`:
+#
+# - preload (DASH_PRELOAD=1): the app module, with the libraries it imports and every dataset it loads at import, is
+#   imported once in the master before the workers are forked. The workers share those pages copy-on-write. The
+#   garbage collector is frozen before the fork so that its bookkeeping does not write to, and thereby copy, the
+#   shared objects. This is where nearly all of the saving comes from: a worker is mostly Python, pandas, plotly and
+#   Dash.
+# - memory-mapped columns (DASH_DATA_MMAP=1, see `columnar_cache.py`): the numeric columns and category codes of the
+#   cached datasets are read-only views of the cache files, shared through the page cache, also for datasets that a
+#   worker loads later, such as the lazy `DatasetRegistry` of `sanitation_map.py`. Anything derived from them is
+#   private to the worker. With the compact dtypes of `schema.py` these arrays are under a megabyte in total, so
+#   without preload the workers cost about as much as with DASH_DATA_MMAP=0; the mapping matters for larger tables.
+#
+# Command line options still override these, e.g. `gunicorn sanitation_map:server --workers 8`.
+import gc
+import os
+
+bind = os.environ.get("DASH_BIND", "127.0.0.1:8050")
+workers = int(os.environ.get("DASH_WORKERS", "2"))
+threads = int(os.environ.get("DASH_THREADS", "4"))
+preload_app = os.environ.get("DASH_PRELOAD", "1") == "1"
+
+# Read by `columnar_cache.py` and `warmup.py` when the app is imported: in the master with preload, in every worker
+# without
+os.environ.setdefault("DASH_DATA_MMAP", "1")
+os.environ.setdefault("DASH_WARMUP", "1")
+
+
+# Called in the master after the app was preloaded and before the first worker is forked
+def when_ready(server):
+    if preload_app:
+        gc.collect()
+        gc.freeze()
@@ -1,12 +1,17 @@
 from dash import Dash, html, dcc, Input, Output
 import plotly.express as px
-import pandas as pd
+from callback_metrics import instrument
+from census_etl import load_census
 
-df = pd.read_csv('sanitation_long2.csv')
+# The Kenya 2019 census table in long format with typed columns, converted by `census_etl.py`
+df = load_census()
 
 app = Dash(__name__)
 server = app.server
 
+# Phase timing of the callbacks at /metrics when DASH_CALLBACK_METRICS=1, see `callback_metrics.py`
+instrument(app)
+
 app.layout = html.Div([
     html.Div("App that shows Percentage Distribution of Human Waste Disposal Across Counties (2019 Census)"),
 
@@ -34,7 +39,7 @@ def update_figure(selected_county):
     # filtered_indicator = df[df.indicator == selected_indicator]
 
     fig = px.bar(filtered_county, x='indicator',
-                 y='value', color='indicator',
+                 y='percent', color='indicator', labels={'percent': 'value'},
                  title="Percentage Distribution of Conventional Households by Main Mode of Human Waste Disposal According to Kenya 2019 Census",
                  height=600)
 
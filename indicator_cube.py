@@ -0,0 +1,83 @@
+# Dense cube of the World Bank indicators in `country_indicators.csv`, used by `indicator_explorer.py`.
+#
+# The CSV is in long format (one row per country, indicator and year). It is pivoted once into a float32 array of shape
+# (country, indicator, year) with NaN for the missing values, plus a boolean array marking the values that exist. Both
+# are saved as .npy files and memory-mapped read-only, so that every gunicorn worker shares the same pages. The view of
+# any x indicator against any y indicator in any year is then a slice of the arrays, with no search:
+#
+#   .cache/indicator_cube/<content key>/   <- meta.json (countries, indicators, years), values.npy, present.npy
+#
+# The content key is a hash of the CSV, so the cube is rebuilt when the CSV changes.
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from columnar_cache import file_digest
+
+SOURCE_CSV = "country_indicators.csv"
+CUBE_DIR = os.environ.get("DASH_CUBE_CACHE", os.path.join(".cache", "indicator_cube"))
+
+
+def build_cube(csv_path, directory):
+    df = pd.read_csv(csv_path)
+    country_codes, countries = pd.factorize(df["Country Name"], sort=True)
+    indicator_codes, indicators = pd.factorize(df["Indicator Name"], sort=True)
+    year_codes, years = pd.factorize(df["Year"], sort=True)
+
+    values = np.full((len(countries), len(indicators), len(years)), np.nan, dtype=np.float32)
+    values[country_codes, indicator_codes, year_codes] = df["Value"].to_numpy(dtype=np.float32)
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "values.npy"), values)
+    np.save(os.path.join(directory, "present.npy"), ~np.isnan(values))
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump({"source": csv_path, "countries": countries.tolist(), "indicators": indicators.tolist(),
+                   "years": [int(year) for year in years]}, f)
+
+
+class IndicatorCube:
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.countries = np.asarray(meta["countries"], dtype=object)
+        self.indicators = meta["indicators"]
+        self.years = meta["years"]
+        self.values = np.load(os.path.join(directory, "values.npy"), mmap_mode="r")
+        self.present = np.load(os.path.join(directory, "present.npy"), mmap_mode="r")
+        self._indicator_positions = {indicator: i for i, indicator in enumerate(self.indicators)}
+        self._year_positions = {year: i for i, year in enumerate(self.years)}
+
+    # Countries with both values in `year`, and their x and y values
+    def view(self, x_indicator, y_indicator, year):
+        x, y = self._indicator_positions[x_indicator], self._indicator_positions[y_indicator]
+        t = self._year_positions[year]
+        mask = self.present[:, x, t] & self.present[:, y, t]
+        return self.countries[mask], self.values[mask, x, t], self.values[mask, y, t]
+
+    # `view` for every year, in the order of `self.years`
+    def views(self, x_indicator, y_indicator):
+        x, y = self._indicator_positions[x_indicator], self._indicator_positions[y_indicator]
+        masks = self.present[:, x, :] & self.present[:, y, :]
+        x_values, y_values = self.values[:, x, :], self.values[:, y, :]
+        return [(self.countries[masks[:, t]], x_values[masks[:, t], t], y_values[masks[:, t], t])
+                for t in range(len(self.years))]
+
+
+# Load the cube of `csv_path`, building it first if the CSV changed since the last build
+def load_cube(csv_path=SOURCE_CSV, cache_dir=None):
+    cache_dir = cache_dir or CUBE_DIR
+    target = os.path.join(cache_dir, file_digest(csv_path))
+    if not os.path.exists(os.path.join(target, "meta.json")):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=cache_dir, prefix=".build-")
+        build_cube(csv_path, tmp)
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            # Another worker finished the same build first
+            shutil.rmtree(tmp, ignore_errors=True)
+    return IndicatorCube(target)
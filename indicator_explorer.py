@@ -0,0 +1,115 @@
+# Import the necessary packages
+import os
+import numpy as np
+import plotly.graph_objects as go
+from dash import Dash, dcc, html, Input, Output
+from indicator_cube import load_cube
+from compression import install_compression
+from callback_metrics import instrument, phase
+from schema import decimal_float64
+from trace_cache import LRUCache
+
+# World Bank indicators of every country, every five years from 1962 to 2007 (the dataset of the Dash tutorial),
+# pivoted into a memory-mapped country x indicator x year cube, see `indicator_cube.py`
+cube = load_cube()
+
+# Animation frames of the most recently drawn pairs of indicators, see `animation_frames`
+FRAME_CACHE_SIZE = int(os.environ.get("DASH_FRAME_CACHE_SIZE", 32))
+frame_cache = LRUCache(FRAME_CACHE_SIZE)
+
+app = Dash(__name__)
+server = app.server
+
+# Phase timing of the callbacks at /metrics when DASH_CALLBACK_METRICS=1, see `callback_metrics.py`
+instrument(app)
+
+# Compress the callback responses and keep them for repeated selections, see `compression.py`
+compression = install_compression(app)
+
+app.layout = html.Div([
+    html.H2("Explorer for the World Bank country indicators"),
+
+    dcc.Markdown('''
+    Pick an indicator for each axis and press *Play*, or move the slider under the chart, to see the countries move
+    through the years.
+    '''),
+
+    # The indicator and the axis type of the x axis
+    html.Div([
+        dcc.Dropdown(cube.indicators, 'Fertility rate, total (births per woman)', id='indicator-x', clearable=False),
+        dcc.RadioItems(['Linear', 'Log'], 'Linear', id='indicator-x-type', inline=True)
+    ], style={'width': '48%', 'display': 'inline-block'}),
+
+    # The indicator and the axis type of the y axis
+    html.Div([
+        dcc.Dropdown(cube.indicators, 'Life expectancy at birth, total (years)', id='indicator-y', clearable=False),
+        dcc.RadioItems(['Linear', 'Log'], 'Linear', id='indicator-y-type', inline=True)
+    ], style={'width': '48%', 'float': 'right', 'display': 'inline-block'}),
+
+    dcc.Graph(id='indicator-graph', style={'height': '700px'}),
+])
+
+
+# Axis range that holds the values of every year, so that the axes stay still during the animation
+def axis_range(values, axis_type):
+    values = np.concatenate(values) if values else np.empty(0)
+    if axis_type == 'Log':
+        values = np.log10(values[values > 0])
+    if not len(values):
+        return None
+    low, high = float(values.min()), float(values.max())
+    padding = (high - low) * 0.05 or 1
+    return [low - padding, high + padding]
+
+
+# One animation frame per year of the cube, built from its slices once per pair of indicators and kept in
+# `frame_cache`. The points are drawn with WebGL (`scattergl`), which stays smooth with every country on the chart. The
+# float32 values of the cube are sent as the float64 numbers of the CSV
+def animation_frames(x_indicator, y_indicator):
+    return frame_cache.get_or_build((x_indicator, y_indicator), lambda: [{
+        'name': str(year),
+        'data': [{'type': 'scattergl', 'mode': 'markers', 'x': decimal_float64(x), 'y': decimal_float64(y),
+                  'text': countries.tolist(), 'marker': {'size': 10, 'opacity': 0.7},
+                  'hovertemplate': '<b>%{text}</b><br>x: %{x}<br>y: %{y}<extra></extra>'}],
+        'layout': {'title': {'text': f'{y_indicator} against {x_indicator} in {year}'}},
+    } for year, (countries, x, y) in zip(cube.years, cube.views(x_indicator, y_indicator))])
+
+
+@app.callback(
+    Output('indicator-graph', 'figure'),
+    Input('indicator-x', 'value'),
+    Input('indicator-y', 'value'),
+    Input('indicator-x-type', 'value'),
+    Input('indicator-y-type', 'value'),
+)
+def update_graph(x_indicator, y_indicator, x_type, y_type):
+    # The frames are only built on the first request for the pair of indicators
+    with phase('figure'):
+        frames = animation_frames(x_indicator, y_indicator)
+    x_range = axis_range([frame['data'][0]['x'] for frame in frames], x_type)
+    y_range = axis_range([frame['data'][0]['y'] for frame in frames], y_type)
+
+    # Jump to a year without a transition, WebGL traces are redrawn rather than tweened
+    def animate(names):
+        return [names, {'mode': 'immediate', 'frame': {'duration': 300, 'redraw': True}, 'transition': {'duration': 0}}]
+
+    with phase('figure'):
+        fig = go.Figure(data=frames[-1]['data'], frames=frames)
+        fig.update_layout(
+            title=frames[-1]['layout']['title'],
+            xaxis={'title': {'text': x_indicator}, 'type': x_type.lower(), 'range': x_range},
+            yaxis={'title': {'text': y_indicator}, 'type': y_type.lower(), 'range': y_range},
+            margin={'l': 40, 'b': 40, 't': 60, 'r': 10},
+            hovermode='closest',
+            updatemenus=[{'type': 'buttons', 'showactive': False, 'x': 0, 'y': -0.08, 'xanchor': 'right',
+                          'buttons': [{'label': 'Play', 'method': 'animate', 'args': animate(None)},
+                                      {'label': 'Pause', 'method': 'animate', 'args': animate([None])}]}],
+            sliders=[{'active': len(frames) - 1, 'x': 0.05, 'len': 0.95, 'currentvalue': {'prefix': 'Year: '},
+                      'steps': [{'label': frame['name'], 'method': 'animate', 'args': animate([frame['name']])}
+                                for frame in frames]}],
+        )
+
+    return fig
+
+if __name__ == '__main__':
+    app.run_server(debug=True)
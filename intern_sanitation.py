@@ -1,21 +1,66 @@
-from dash import Dash, dcc, html, Input, Output
+from dash import Dash, dcc, html, Input, Output, Patch, State
+import hashlib
+import itertools
+import threading
 import pandas as pd
 import plotly.express as px
+import plotly.io as pio
 import numpy as np
-
-# Import the data
-df_drinking = pd.read_csv("archive/Basic and safely managed drinking water services.csv")
-df_sanitation = pd.read_csv("archive/Basic and safely managed sanitation services.csv")
-df_handwashing = pd.read_csv("archive/Handwashing with soap.csv")
-df_defecation = pd.read_csv("archive/Open defecation.csv")
+from downloads import DOWNLOAD_FORMAT_LABELS, FORMATS, DatasetDownloads
+from compression import install_compression
+from warmup import ENABLED as WARMUP_ENABLED, install_warmup
+from sanitation_data import DatasetRegistry, SliceIndex, dataset_versions, load_who_datasets
+from trace_cache import LRUCache
+from callback_metrics import instrument, phase
+
+# Import the data (through the shared columnar cache, see `columnar_cache.py`)
+data_version = dataset_versions()
+reload_lock = threading.Lock()
+datasets = load_who_datasets()
+df_drinking = datasets["drinking"]
+df_sanitation = datasets["sanitation"]
+df_handwashing = datasets["handwashing"]
+df_defecation = datasets["open_defecation"]
+
+# Row index of each dataset by (Country, Residence Area Type), so the callbacks below do not scan and sort
+# the whole dataframe on every dropdown change
+drinking_index = SliceIndex(df_drinking)
+sanitation_index = SliceIndex(df_sanitation)
+handwashing_index = SliceIndex(df_handwashing)
+defecation_index = SliceIndex(df_defecation)
 
 # External stylesheets
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 app = Dash(__name__, external_stylesheets=external_stylesheets)
 server = app.server
 
-# Map countries to color
-c = dict(zip(df_drinking.Country.unique(), px.colors.qualitative.Plotly))
+# Phase timing of the callbacks at /metrics when DASH_CALLBACK_METRICS=1, see `callback_metrics.py`
+instrument(app)
+
+# Compress the callback responses and keep them for repeated selections, see `compression.py`. The cached responses
+# are only valid for the data they were computed from
+compression = install_compression(app, version=lambda: refresh_data())
+
+# Downloads of the four datasets, streamed by the Flask server instead of going through a callback. They are exported
+# from the source files with all their columns and values, not from the trimmed dataframes of the charts
+downloads = DatasetDownloads(app, DatasetRegistry(read_csv_kwargs={}), {"drinking": "drinking_water", "sanitation": "sanitation_services",
+                                             "handwashing": "handwashing", "open_defecation": "open_defecation"},
+                             version=lambda: refresh_data())
+
+# Download link id -> dataset
+download_links = {"download_drinking_water_csv": "drinking", "download_sanitation_services_csv": "sanitation",
+                  "download_handwashing_csv": "handwashing", "download_open_defecation_csv": "open_defecation"}
+
+# Map countries to color. The palette repeats so that every country keeps the same color in every figure, which lets
+# the per-country traces below be cached and reused in any selection
+all_countries = pd.unique(pd.concat([df.Country for df in datasets.values()]))
+c = dict(zip(all_countries, itertools.cycle(px.colors.qualitative.Plotly)))
+
+# Cache of single-country traces keyed by (dataset, chart kind, country, residence area type)
+trace_cache = LRUCache()
+
+# The figures are assembled from cached traces instead of plotly express, so the default template is applied here
+template = pio.templates[pio.templates.default].to_plotly_json()
 
 # Create the app layout
 app.layout = html.Div([
@@ -54,7 +99,28 @@ app.layout = html.Div([
         )
     ]),
 
+    # The selection of countries and residence area type the charts show
+    dcc.Store(id="chart_selection"),
+
     html.Br(),
+
+    # Format of the downloads and whether they only contain the selected countries and residence area type
+    html.Div(className="row", children=[
+        dcc.Dropdown(className="six columns",
+            options=[{"label": DOWNLOAD_FORMAT_LABELS[fmt], "value": fmt} for fmt in FORMATS],
+            value="csv",
+            id="download_format",
+            clearable=False,
+            style={'width': '30%', 'display': 'inline-block'}
+        ),
+        dcc.Checklist(className="six columns",
+            options=[{"label": " Download only the selected countries and residence area type", "value": "selection"}],
+            value=[],
+            id="download_scope",
+            style={'width': '70%', 'display': 'inline-block'}
+        )
+    ]),
+
     html.Br(),
 
     # Drinking water
@@ -70,8 +136,7 @@ app.layout = html.Div([
     # Download button for drinking water dataframe
     html.Div(children=[
         html.Div(children=[
-            html.Button("Download Drinking Water Dataframe", id="drinking_water_df"),
-            dcc.Download(id="download_drinking_water_csv")
+            html.A("Download Drinking Water Dataframe", id="download_drinking_water_csv", className="button")
         ])
     ]),
 
@@ -88,8 +153,7 @@ app.layout = html.Div([
     # Download button for sanitation services dataframe
     html.Div(children=[
         html.Div(children=[
-            html.Button("Download Sanitation Services Dataframe", id="sanitation_services_df"),
-            dcc.Download(id="download_sanitation_services_csv")
+            html.A("Download Sanitation Services Dataframe", id="download_sanitation_services_csv", className="button")
         ])
     ]),
 
@@ -106,8 +170,7 @@ app.layout = html.Div([
     # Download button for handwashing dataframe
     html.Div(children=[
         html.Div(children=[
-            html.Button("Download Handwashing Dataframe", id="handwashing_df"),
-            dcc.Download(id="download_handwashing_csv")
+            html.A("Download Handwashing Dataframe", id="download_handwashing_csv", className="button")
         ])
     ]),
 
@@ -124,222 +187,187 @@ app.layout = html.Div([
     # Download button for open defecation dataframe
     html.Div(children=[
         html.Div(children=[
-            html.Button("Download Open Defecation Dataframe", id="open_defecation_df"),
-            dcc.Download(id="download_open_defecation_csv")
+            html.A("Download Open Defecation Dataframe", id="download_open_defecation_csv", className="button")
         ])
     ]),
 
 ])
 
-# Bar chart for drinking water
+# The two charts drawn for each dataset: the graph ids and the chart titles (the year range is appended)
+charts = [
+    {"name": "drinking", "index": drinking_index, "bar_id": "stack_bar_drinking_water", "line_id": "line_graph_drinking_water",
+     "bar_title": "Bar chart showing average percentage (%) of population using safely " + "<br>" +
+                  "managed drinking-water services (%)",
+     "line_title": "Line chart showing population using safely " + "<br>" + "managed drinking-water services (%)"},
+    {"name": "sanitation", "index": sanitation_index, "bar_id": "stack_bar_sanitation_services", "line_id": "line_graph_sanitation_services",
+     "bar_title": "Bar chart showing average percentage (%) of population using safely " + "<br>" +
+                  "managed sanitation services",
+     "line_title": "Line chart showing population using safely " + "<br>" + "safely managed sanitation services (%)"},
+    {"name": "handwashing", "index": handwashing_index, "bar_id": "stack_bar_handwashing", "line_id": "line_graph_handwashing",
+     "bar_title": "Bar chart showing average percentage (%) of population using " + "<br>" +
+                  "basic handwashing facilities at home",
+     "line_title": "Line chart showing population using " + "<br>" + "basic handwashing facilities at home (%)"},
+    {"name": "open_defecation", "index": defecation_index, "bar_id": "stack_bar_defecation", "line_id": "line_graph_defecation",
+     "bar_title": "Bar chart showing average percentage of " + "<br>" +
+                  "population practising open defecation (% Average)",
+     "line_title": "Line chart showing population practising open defecation (%)"},
+]
+
+# Line trace (the percentage across the years) of one country
+def line_trace(chart, country, residence_type):
+    dff = chart["index"].rows([country], residence_type)
+    return {"type": "scatter", "mode": "lines+markers", "orientation": "v",
+            "x": dff["Year"].tolist(), "y": dff["Display Value"].tolist(),
+            "name": country, "legendgroup": country, "showlegend": True,
+            "line": {"color": c[country], "dash": "solid"}, "marker": {"symbol": "circle"},
+            "hovertemplate": f"Country={country}<br>Year=%{{x}}<br>Display Value=%{{y}}<extra></extra>"}
+
+trace_builders = {"line": line_trace}
+
+# Cached traces of one chart kind for the selected countries that have data for the residence area type
+def cached_traces(chart, kind, countries, residence_type):
+    build = trace_builders[kind]
+    return [trace_cache.get_or_build((chart["name"], kind, country, residence_type),
+                                     lambda: build(chart, country, residence_type))
+            for country in countries if (country, residence_type) in chart["index"].ranges]
+
+# Load the datasets again when their CSV files have changed, and drop everything computed from the old data: the
+# indexes (and their means), the cached traces, the cached callback responses and the full downloads. Returns the
+# version of the data in use
+def refresh_data():
+    global data_version
+    version = dataset_versions()
+    if version != data_version:
+        with reload_lock:
+            if version != data_version:
+                datasets.update(load_who_datasets())
+                for chart in charts:
+                    chart["index"] = SliceIndex(datasets[chart["name"]])
+                palette = px.colors.qualitative.Plotly
+                for country in pd.unique(pd.concat([df.Country for df in datasets.values()])):
+                    c.setdefault(country, palette[len(c) % len(palette)])
+                trace_cache.clear()
+                compression.cache.clear()
+                downloads.clear()
+                data_version = version
+    return data_version
+
+# Countries of the selection that have data for the residence area type, with their mean percentage and color
+def bar_values(chart, countries, residence_type):
+    means = chart["index"].means
+    selected = [country for country in countries if (country, residence_type) in means]
+    values = [means[(country, residence_type)] for country in selected]
+    return selected, [None if np.isnan(value) else float(value) for value in values], [c[country] for country in selected]
+
+# Bar chart of the average percentage for each selected country: one bar per country, from the means precomputed by
+# `SliceIndex`, in a single trace. The figure no longer carries every yearly row of the selected countries
+def histogram(chart, countries, residence_type, title):
+    selected, values, colors = bar_values(chart, countries, residence_type)
+    trace = {"type": "bar", "orientation": "v", "x": selected, "y": values,
+             "marker": {"color": colors}, "showlegend": False,
+             "hovertemplate": "Country=%{x}<br>avg of Display Value=%{y}<extra></extra>"}
+
+    return {"data": [trace],
+            "layout": {"template": template, "title": {"text": title},
+                       "xaxis": {"title": {"text": "Country"}, "categoryorder": "array", "categoryarray": selected},
+                       "yaxis": {"title": {"text": "avg of Display Value"}},
+                       "transition": {"duration": 100, "easing": "linear"}}}
+
+# Line chart of the percentage across the years for each selected country
+def line_chart(chart, countries, residence_type, title):
+    traces = cached_traces(chart, "line", countries, residence_type)
+
+    return {"data": traces,
+            "layout": {"template": template, "title": {"text": title},
+                       "xaxis": {"title": {"text": "Year"}},
+                       "yaxis": {"title": {"text": "Display Value"}},
+                       "legend": {"title": {"text": "Country"}, "tracegroupgap": 0},
+                       "transition": {"duration": 100, "easing": "linear"}}}
+
+# Changes to the bar and line charts of `chart` going from the `previous` selection of countries to `countries`: the
+# bars and traces of the removed countries are deleted, those of the added countries appended and the titles updated.
+# None when the charts are better drawn again: when the order of the countries that stay has changed, or when more
+# countries are removed than stay (the deletions would then be larger than the figures)
+def chart_patches(chart, previous, countries, residence_type, bar_title, line_title):
+    ranges = chart["index"].ranges
+    before = [country for country in previous if (country, residence_type) in ranges]
+    after = [country for country in countries if (country, residence_type) in ranges]
+    kept = [country for country in before if country in set(after)]
+    added = [country for country in after if country not in set(before)]
+    if kept + added != after or len(before) - len(kept) > len(after):
+        return None
+
+    bar, line = Patch(), Patch()
+    # Delete from the end, so that the positions of the other removed countries stay valid
+    for position in reversed([i for i, country in enumerate(before) if country not in set(after)]):
+        del bar["data"][0]["x"][position]
+        del bar["data"][0]["y"][position]
+        del bar["data"][0]["marker"]["color"][position]
+        del bar["layout"]["xaxis"]["categoryarray"][position]
+        del line["data"][position]
+
+    if added:
+        selected, values, colors = bar_values(chart, added, residence_type)
+        bar["data"][0]["x"].extend(selected)
+        bar["data"][0]["y"].extend(values)
+        bar["data"][0]["marker"]["color"].extend(colors)
+        bar["layout"]["xaxis"]["categoryarray"].extend(selected)
+        line["data"].extend(cached_traces(chart, "line", added, residence_type))
+
+    bar["layout"]["title"]["text"] = bar_title
+    line["layout"]["title"]["text"] = line_title
+    return bar, line
+
+# Draw all eight charts in one callback, so a dropdown change costs one request and each dataset is filtered once.
+# `chart_selection` keeps the selection the charts in the browser show: when only countries are added or removed, the
+# charts are patched with the difference instead of being sent again
 @app.callback(
-    Output("stack_bar_drinking_water", "figure"),
+    [Output(chart[graph_id], "figure") for chart in charts for graph_id in ("bar_id", "line_id")],
+    Output("chart_selection", "data"),
     Input("country_dropdown", "value"),
-    Input("residence_dropdown", "value")
+    Input("residence_dropdown", "value"),
+    State("chart_selection", "data")
 )
-def histogram(x_axis_column_name, residence_type):
-    dff = df_drinking[df_drinking['Country'].isin(x_axis_column_name)]
-    dff = dff.sort_values(by='Year')
-
-    fig = px.histogram(dff[dff['Residence Area Type'] == residence_type], x='Country', y='Display Value', histfunc='avg',
-                       color='Country', title=f"Bar chart showing average percentage (%) of population using safely " + "<br>" +
-                                              f"managed drinking-water services (%) {dff['Year'].min()}-{dff['Year'].max()}",
-                       color_discrete_map=c,
-                       )
-
-    fig.update_layout(transition={'duration': 100,
-                                  'easing': 'linear'})
-
-    return fig
-
-# Line chart for drinking
+def update_charts(x_axis_column_name, residence_type, previous):
+    version = hashlib.blake2b(repr(sorted(refresh_data().items())).encode(), digest_size=8).hexdigest()
+    countries = x_axis_column_name or []
+    incremental = previous is not None and previous["residence"] == residence_type and previous["version"] == version
+
+    figures = []
+    for chart in charts:
+        year_min, year_max = chart["index"].year_range(countries)
+        bar_title = f"{chart['bar_title']} {year_min}-{year_max}"
+        line_title = f"{chart['line_title']} {year_min}-{year_max}"
+
+        with phase("figure"):
+            patches = incremental and chart_patches(chart, previous["countries"], countries, residence_type,
+                                                    bar_title, line_title)
+            if patches:
+                figures.extend(patches)
+            else:
+                figures.append(histogram(chart, countries, residence_type, bar_title))
+                figures.append(line_chart(chart, countries, residence_type, line_title))
+
+    return figures + [{"countries": countries, "residence": residence_type, "version": version}]
+
+# Point the download buttons at the selected format and scope. The files themselves are served by `downloads`
 @app.callback(
-    Output("line_graph_drinking_water", "figure"),
+    [Output(link_id, "href") for link_id in download_links],
+    Input("download_format", "value"),
+    Input("download_scope", "value"),
     Input("country_dropdown", "value"),
     Input("residence_dropdown", "value")
 )
-def line_chart(x_axis_column_name, residence_type):
-
-    dff = df_drinking[df_drinking['Country'].isin(x_axis_column_name)]
-    dff = dff.sort_values(by='Year')
-
-    fig = px.line(dff[dff['Residence Area Type'] == residence_type], x='Year', y='Display Value', markers=True,
-                      color='Country', title=f"Line chart showing population using safely " + "<br>" +
-                                             f"managed drinking-water services (%) {dff['Year'].min()}-{dff['Year'].max()}",
-                  color_discrete_map=c,
-                  )
-
-    fig.update_layout(transition={'duration': 100,
-                                  'easing': 'linear'})
-
-    return fig
-
-# Function to download drinking water dataframe
-@app.callback(
-    Output("download_drinking_water_csv", "data"),
-    Input("drinking_water_df", "n_clicks"),
-    prevent_initial_call=True
-)
-def download_df(n_clicks):
-    return dcc.send_data_frame(df_drinking.to_csv, "drinking_water.csv")
-
-# Bar chart for sanitation services
-@app.callback(
-    Output("stack_bar_sanitation_services", "figure"),
-    Input("country_dropdown", "value"),
-    Input("residence_dropdown", "value")
-)
-def histogram(x_axis_column_name, residence_type):
-    dff = df_sanitation[df_sanitation['Country'].isin(x_axis_column_name)]
-    dff = dff.sort_values(by='Year')
-
-    fig = px.histogram(dff[dff['Residence Area Type'] == residence_type], x='Country', y='Display Value',
-                       histfunc='avg',
-                       color='Country', title=f"Bar chart showing average percentage (%) of population using safely " + "<br>" +
-                                              f"managed sanitation services {dff['Year'].min()}-{dff['Year'].max()}",
-                       color_discrete_map=c,
-                       )
-
-    fig.update_layout(transition={'duration': 100,
-                                  'easing': 'linear'})
-
-    return fig
-
-# Line Graph for sanitation services
-@app.callback(
-    Output("line_graph_sanitation_services", "figure"),
-    Input("country_dropdown", "value"),
-    Input("residence_dropdown", "value")
-)
-def line_chart(x_axis_column_name, residence_type):
-
-    dff = df_sanitation[df_sanitation['Country'].isin(x_axis_column_name)]
-    dff = dff.sort_values(by='Year')
-
-    fig = px.line(dff[dff['Residence Area Type'] == residence_type], x='Year', y='Display Value', markers=True,
-                      color='Country', title=f"Line chart showing population using safely " + "<br>" +
-                                             f"safely managed sanitation services (%) {dff['Year'].min()}-{dff['Year'].max()}",
-                  color_discrete_map=c,
-                 )
-
-    fig.update_layout(transition={'duration': 100,
-                                  'easing': 'linear'})
+def update_download_links(fmt, scope, countries, residence_type):
+    selection = {"country": countries, "residence": residence_type} if "selection" in (scope or []) else {}
+    return [downloads.url(name, fmt, **selection) for name in download_links.values()]
 
-    return fig
+# Render the default view and the most requested selections into the response cache at start, see `warmup.py`
+warmup = install_warmup(app, compression, "intern_sanitation")
 
-# Function to download sanitation services dataframe
-@app.callback(
-    Output("download_sanitation_services_csv", "data"),
-    Input("sanitation_services_df", "n_clicks"),
-    prevent_initial_call=True
-)
-def download_df(n_clicks):
-    return dcc.send_data_frame(df_sanitation.to_csv, "sanitation_services.csv")
-
-# Bar chart for handwashing services
-@app.callback(
-    Output("stack_bar_handwashing", "figure"),
-    Input("country_dropdown", "value"),
-    Input("residence_dropdown", "value")
-)
-def histogram(x_axis_column_name, residence_type):
-    dff = df_handwashing[df_handwashing['Country'].isin(x_axis_column_name)]
-    dff = dff.sort_values(by='Year')
-
-    fig = px.histogram(dff[dff['Residence Area Type'] == residence_type], x='Country', y='Display Value',
-                       histfunc='avg',
-                       color='Country', title=f"Bar chart showing average percentage (%) of population using " + "<br>" +
-                                              f"basic handwashing facilities at home {dff['Year'].min()}-{dff['Year'].max()}",
-                       color_discrete_map=c,
-                       )
-
-    fig.update_layout(transition={'duration': 100,
-                                  'easing': 'linear'})
-
-    return fig
-
-# Line chart for handwashing
-@app.callback(
-    Output("line_graph_handwashing", "figure"),
-    Input("country_dropdown", "value"),
-    Input("residence_dropdown", "value")
-)
-def line_chart(x_axis_column_name, residence_type):
-
-    dff = df_handwashing[df_handwashing['Country'].isin(x_axis_column_name)]
-    dff = dff.sort_values(by='Year')
-
-    fig = px.line(dff[dff['Residence Area Type'] == residence_type], x='Year', y='Display Value', markers=True,
-                      color='Country', title=f"Line chart showing population using " + "<br>" +
-                                             f"basic handwashing facilities at home (%) {dff['Year'].min()}-{dff['Year'].max()}",
-                  color_discrete_map=c,
-                  )
-
-    fig.update_layout(transition={'duration': 100,
-                                  'easing': 'linear'})
-
-    return fig
-
-# Function to download handwashing dataframe
-@app.callback(
-    Output("download_handwashing_csv", "data"),
-    Input("handwashing_df", "n_clicks"),
-    prevent_initial_call=True
-)
-def download_df(n_clicks):
-    return dcc.send_data_frame(df_handwashing.to_csv, "handwashing.csv")
-
-# Bar chart for open defecation
-@app.callback(
-    Output("stack_bar_defecation", "figure"),
-    Input("country_dropdown", "value"),
-    Input("residence_dropdown", "value")
-)
-def histogram(x_axis_column_name, residence_type):
-    dff = df_defecation[df_defecation['Country'].isin(x_axis_column_name)]
-    dff = dff.sort_values(by='Year')
-
-    fig = px.histogram(dff[dff['Residence Area Type'] == residence_type], x='Country', y='Display Value',
-                       histfunc='avg',
-                       color='Country', title=f"Bar chart showing average percentage of " + "<br>" +
-                                              f"population practising open defecation (% Average) {dff['Year'].min()}-{dff['Year'].max()}",
-                       color_discrete_map=c,
-                       )
-
-    fig.update_layout(transition={'duration': 100,
-                                  'easing': 'linear'})
-
-    return fig
-
-# Line chart for open defecation
-@app.callback(
-    Output("line_graph_defecation", "figure"),
-    Input("country_dropdown", "value"),
-    Input("residence_dropdown", "value")
-)
-def line_chart(x_axis_column_name, residence_type):
-
-    dff = df_defecation[df_defecation['Country'].isin(x_axis_column_name)]
-    dff = dff.sort_values(by='Year')
-
-    fig = px.line(dff[dff['Residence Area Type'] == residence_type], x='Year', y='Display Value', markers=True,
-                      color='Country', title=f"Line chart showing population practising open defecation (%) {dff['Year'].min()}-{dff['Year'].max()}",
-                  color_discrete_map=c,
-                  )
-
-    fig.update_layout(transition={'duration': 100,
-                                  'easing': 'linear'})
-
-    return fig
-
-# Function to download open defecation dataframe
-@app.callback(
-    Output("download_open_defecation_csv", "data"),
-    Input("open_defecation_df", "n_clicks"),
-    prevent_initial_call=True
-)
-def download_df(n_clicks):
-    return dcc.send_data_frame(df_defecation.to_csv, "open_defecation.csv")
+# Build the CSV exports of the whole datasets along with the warm-up, so that the first downloads are served from memory
+if WARMUP_ENABLED:
+    downloads.prebuild()
 
 # Run the app
 if __name__ == "__main__":
@@ -1,28 +1,10 @@
-# Load the wide table of human_waste
-import pandas as pd
-data = pd.read_csv('D:\gachuhi\dash-projects\human_waste_filtered.csv')
+# Write the census table in long format to census_sanitation_long.csv: one row per county and disposal method, with the
+# number of conventional households and the percentage in separate columns. The dashboards load the typed artifact of
+# `census_etl.py` instead. (sanitation_long.csv is the older melt, with the counts mixed into the percentages)
+from census_etl import load_census
 
-data_long = pd.melt(data, id_vars='County', var_name='indicator', value_name='value', ignore_index='False')
+data_long = load_census()
 
 print(data_long.head())
 
-data_long.to_csv('sanitation_long.csv', sep=',')
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+data_long.to_csv('census_sanitation_long.csv', index=False)
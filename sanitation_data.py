@@ -0,0 +1,265 @@
+# Shared loader for the WHO sanitation datasets used by `intern_sanitation.py` and `sanitation_map.py`.
+# The sanitation dataframes are from Kaggle: https://www.kaggle.com/datasets/navinmundhra/world-sanitation
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from columnar_cache import cached_read_csv
+from schema import WHO_SCHEMA, decimal_float64
+
+# Dataset name -> source CSV. The names match the options of the dataframe dropdown in `sanitation_map.py`
+WHO_DATASETS = {
+    "drinking": "archive/Basic and safely managed drinking water services.csv",
+    "sanitation": "archive/Basic and safely managed sanitation services.csv",
+    "handwashing": "archive/Handwashing with soap.csv",
+    "open_defecation": "archive/Open defecation.csv",
+}
+
+
+# Load one WHO dataset through the columnar cache, with the columns and types of `WHO_SCHEMA`
+def load_who_dataset(name):
+    return WHO_SCHEMA.widen(cached_read_csv(WHO_DATASETS[name], **WHO_SCHEMA.read_csv_kwargs()))
+
+
+# Load the WHO datasets (all of them by default) in parallel
+def load_who_datasets(names=None):
+    names = list(names or WHO_DATASETS)
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        frames = pool.map(load_who_dataset, names)
+    return dict(zip(names, frames))
+
+
+# (modification time, size) of the source CSVs, to notice that the datasets have to be loaded again
+def dataset_versions(names=None):
+    return {name: (stat.st_mtime_ns, stat.st_size)
+            for name, stat in ((name, os.stat(WHO_DATASETS[name])) for name in names or WHO_DATASETS)}
+
+
+# Memory the datasets of a `DatasetRegistry` may use before the least recently used ones are dropped
+DATASET_MEMORY_BUDGET = int(os.environ.get("DASH_DATASET_BUDGET_MB", 256)) * 2 ** 20
+
+
+# The WHO datasets by name, each loaded (through the columnar cache) the first time it is used rather than at startup.
+# The memory of every loaded dataset is tracked and, when they use more than `budget` bytes together, the least
+# recently used datasets are dropped; they are loaded again the next time they are used. A dataset whose source CSV
+# changed since it was loaded is loaded again too; `versions()` is the version of the data to key cached responses on.
+# The datasets have the columns and types of `WHO_SCHEMA` unless other `read_csv_kwargs` are given, e.g. `{}` for every
+# column of the source file as it is.
+class DatasetRegistry:
+    def __init__(self, sources=None, budget=DATASET_MEMORY_BUDGET, read_csv_kwargs=None):
+        self.sources = dict(sources or WHO_DATASETS)
+        self.budget = budget
+        self.read_csv_kwargs = WHO_SCHEMA.read_csv_kwargs() if read_csv_kwargs is None else read_csv_kwargs
+        self.loads = dict.fromkeys(self.sources, 0)
+        self._frames = OrderedDict()
+        self._sizes = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in self.sources}
+
+    def __iter__(self):
+        return iter(self.sources)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __contains__(self, name):
+        return name in self.sources
+
+    # (modification time, size) of the source CSV of `name`
+    def version(self, name):
+        stat = os.stat(self.sources[name])
+        return stat.st_mtime_ns, stat.st_size
+
+    def versions(self):
+        return {name: self.version(name) for name in self.sources}
+
+    def _loaded(self, name, version):
+        if name in self._frames and self._versions[name] == version:
+            self._frames.move_to_end(name)
+            return self._frames[name]
+        return None
+
+    def __getitem__(self, name):
+        version = self.version(name)
+        with self._lock:
+            df = self._loaded(name, version)
+        if df is not None:
+            return df
+
+        # One thread loads a dataset while the others asking for it wait
+        with self._load_locks[name]:
+            with self._lock:
+                df = self._loaded(name, version)
+            if df is not None:
+                return df
+            df = WHO_SCHEMA.widen(cached_read_csv(self.sources[name], **self.read_csv_kwargs))
+            size = int(df.memory_usage(index=True, deep=True).sum())
+
+            with self._lock:
+                self._frames[name] = df
+                self._frames.move_to_end(name)
+                self._sizes[name] = size
+                self._versions[name] = version
+                self.loads[name] += 1
+                while len(self._frames) > 1 and sum(self._sizes.values()) > self.budget:
+                    evicted, _ = self._frames.popitem(last=False)
+                    del self._sizes[evicted], self._versions[evicted]
+            return df
+
+    # Bytes used by each loaded dataset
+    def resident(self):
+        with self._lock:
+            return dict(self._sizes)
+
+    def stats(self):
+        resident = self.resident()
+        return {"budget": self.budget, "resident_bytes": sum(resident.values()),
+                "datasets": {name: {"loaded": name in resident, "bytes": resident.get(name, 0),
+                                    "loads": self.loads[name]} for name in self.sources}}
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._sizes.clear()
+            self._versions.clear()
+
+
+# Order of the rows of one WHO dataset sorted by (Country, Residence Area Type, Year), plus the range of every
+# (Country, Residence Area Type) pair in that order. The dashboard callbacks use it to gather the rows of the selected
+# countries without scanning or sorting the whole table on every request. The dataset itself is not copied, so its
+# memory-mapped columns stay shared between the workers (see `columnar_cache.py`)
+class SliceIndex:
+    def __init__(self, df):
+        country_codes, countries = pd.factorize(df["Country"])
+        residence_codes, residences = pd.factorize(df["Residence Area Type"])
+        years = df["Year"].to_numpy()
+
+        # np.lexsort is stable, so rows with the same year keep the order they have in the CSV
+        order = np.lexsort((years, residence_codes, country_codes))
+        self.frame = df.reset_index(drop=True)
+        self.order = order
+
+        country_codes, residence_codes = country_codes[order], residence_codes[order]
+        starts = np.flatnonzero(np.r_[True, (np.diff(country_codes) != 0) | (np.diff(residence_codes) != 0)])
+        stops = np.r_[starts[1:], len(order)]
+        self.ranges = {(countries[country_codes[start]], residences[residence_codes[start]]): (start, stop)
+                       for start, stop in zip(starts, stops)}
+
+        # Mean "Display Value" of every (Country, Residence Area Type) pair, ignoring missing values like
+        # `histfunc='avg'` does. The bar charts show these instead of sending every row to the browser
+        values = self.frame["Display Value"].to_numpy(dtype=float)[order]
+        valid = ~np.isnan(values)
+        sums = np.add.reduceat(np.where(valid, values, 0.0), starts) if len(starts) else np.empty(0)
+        counts = np.add.reduceat(valid.astype(np.intp), starts) if len(starts) else np.empty(0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.means = dict(zip(self.ranges, sums / counts))
+
+        # First and last year of each country over all residence area types (used in the chart titles)
+        spans = self.frame.groupby("Country", sort=False)["Year"].agg(["min", "max"])
+        self.year_spans = dict(zip(spans.index, zip(spans["min"], spans["max"])))
+
+    # Positions (in the sorted order) of the rows for the given countries and residence area type
+    def positions(self, countries, residence_type):
+        ranges = [self.ranges[key] for key in ((country, residence_type) for country in countries or [])
+                  if key in self.ranges]
+        if not ranges:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate([np.arange(start, stop) for start, stop in ranges])
+
+    # Rows for the given countries and residence area type, sorted by year within each country and indexed by their
+    # positions in the sorted order
+    def rows(self, countries, residence_type):
+        if countries and len(countries) == 1:
+            start, stop = self.ranges.get((countries[0], residence_type), (0, 0))
+            positions = np.arange(start, stop)
+        else:
+            positions = self.positions(countries, residence_type)
+        rows = self.frame.take(self.order[positions])
+        rows.index = positions
+        return rows
+
+    # (first year, last year) over the given countries, nan when none of them is in the dataset
+    def year_range(self, countries):
+        spans = [self.year_spans[country] for country in countries or [] if country in self.year_spans]
+        if not spans:
+            return np.nan, np.nan
+        return min(span[0] for span in spans), max(span[1] for span in spans)
+
+
+# Minimum number of (country, year) pairs with both values for a correlation to be reported
+MIN_CORRELATION_PAIRS = 10
+
+
+# The WHO datasets joined on (Country, Residence Area Type, Year): one array of shape (country, residence area type,
+# year, indicator) holding the "Display Value" of every indicator of every dataset, NaN where it is missing. A question
+# over several indicators, e.g. basic drinking water against open defecation in the rural areas in 2010, is one slice
+# of it instead of a filter of each dataset and a merge.
+class AlignedIndicators:
+    def __init__(self, datasets):
+        columns = ["Country", "Residence Area Type", "Year", "Indicator", "Display Value"]
+        long = pd.concat([df[columns].astype({"Country": str, "Residence Area Type": str, "Indicator": str})
+                          for df in datasets.values()], ignore_index=True)
+        country_codes, self.countries = pd.factorize(long["Country"], sort=True)
+        residence_codes, self.residences = pd.factorize(long["Residence Area Type"], sort=True)
+        year_codes, self.years = pd.factorize(long["Year"], sort=True)
+        # The indicators in the order of the datasets
+        indicator_codes, self.indicators = pd.factorize(long["Indicator"])
+        self.countries = np.asarray(self.countries, dtype=object)
+        self.residences, self.indicators = list(self.residences), list(self.indicators)
+        self.years = [int(year) for year in self.years]
+
+        self.values = np.full((len(self.countries), len(self.residences), len(self.years), len(self.indicators)),
+                              np.nan, dtype=np.float32)
+        self.values[country_codes, residence_codes, year_codes, indicator_codes] = long["Display Value"].to_numpy()
+
+        self._residence_positions = {residence: i for i, residence in enumerate(self.residences)}
+        self._year_positions = {year: i for i, year in enumerate(self.years)}
+        self._indicator_positions = {indicator: i for i, indicator in enumerate(self.indicators)}
+        # Names of the rows of `self._rows(residence, None)`
+        self._country_years = np.asarray([f"{country} {year}" for country in self.countries for year in self.years],
+                                         dtype=object)
+
+        # Correlation of every pair of indicators over the countries, for each residence area type and year, and over
+        # all the years (key `None`)
+        self.correlations, self.pair_counts = {}, {}
+        for residence in self.residences:
+            for year in self.years + [None]:
+                self.correlations[residence, year], self.pair_counts[residence, year] = \
+                    self._correlate(self._rows(residence, year))
+
+    # (country, indicator) values of a residence area type in a year, or (country and year, indicator) for all years
+    def _rows(self, residence, year):
+        r = self._residence_positions[residence]
+        if year is None:
+            return self.values[:, r].reshape(-1, len(self.indicators))
+        return self.values[:, r, self._year_positions[year]]
+
+    # Pearson correlation of every pair of columns over the rows that have both values, and the number of those rows
+    @staticmethod
+    def _correlate(rows):
+        present = ~np.isnan(rows)
+        counts = present.T.astype(np.intp) @ present.astype(np.intp)
+        correlations = pd.DataFrame(rows.astype(float)).corr(min_periods=MIN_CORRELATION_PAIRS).to_numpy()
+        return correlations, counts
+
+    # Countries with a value of both indicators, and those values. Over all the years the countries are named with the
+    # year, e.g. "Kenya 2010"
+    def pair(self, x_indicator, y_indicator, residence, year):
+        x, y = self._indicator_positions[x_indicator], self._indicator_positions[y_indicator]
+        rows = self._rows(residence, year)
+        mask = ~(np.isnan(rows[:, x]) | np.isnan(rows[:, y]))
+        return ((self.countries if year is not None else self._country_years)[mask],
+                decimal_float64(rows[mask, x]), decimal_float64(rows[mask, y]))
+
+    # The aligned table: one row per (Country, Residence Area Type, Year) with a value, one column per indicator
+    def table(self):
+        index = pd.MultiIndex.from_product([self.countries, self.residences, self.years],
+                                           names=["Country", "Residence Area Type", "Year"])
+        table = pd.DataFrame(decimal_float64(self.values.reshape(len(index), len(self.indicators))), index=index,
+                             columns=self.indicators)
+        return table.dropna(how="all").reset_index()
@@ -1,34 +1,29 @@
+import os
 import plotly.express as px
-import pandas as pd
-from dash import Dash, dcc, Input, Output, html
+from dash import Dash, dcc, Input, Output, State, html
+from downloads import DOWNLOAD_FORMAT_LABELS, FORMATS, DatasetDownloads
+from compression import install_compression
+from warmup import ENABLED as WARMUP_ENABLED, install_warmup
+from sanitation_data import DatasetRegistry
+from callback_metrics import instrument
 
 # The sanitation dataframes from Kaggle: https://www.kaggle.com/datasets/navinmundhra/world-sanitation
-df_drinking = pd.read_csv("archive/Basic and safely managed drinking water services.csv")
-df_sanitation = pd.read_csv("archive/Basic and safely managed sanitation services.csv")
-df_handwashing = pd.read_csv("archive/Handwashing with soap.csv")
-df_open_defecation = pd.read_csv("archive/Open defecation.csv")
-
-# This dictionary will help in matching the string options from the dash dropdown to the correct datasets
-dataframe_dict = {"Titles": ["Drinking_water_dataframe", "Sanitation_services_dataframe", "Handwashing_dataframe", "Open_defecation"],
-              "Dataframes": ['drinking', 'sanitation', 'handwashing', 'open_defecation'] }
-
-# Convert the `dataframe_dict` dictionary to a pandas dataframe
-dataframe_table = pd.DataFrame(dataframe_dict)
-
-# Function to get minimum and maximum year value in each dataframe
-for dataframe in dataframe_table["Dataframes"]:
-    if dataframe == "drinking":
-        min_year = df_drinking["Year"].min()
-        max_year = df_drinking["Year"].max()
-    elif dataframe == "sanitation":
-        min_year = df_sanitation["Year"].min()
-        max_year = df_sanitation["Year"].max()
-    elif dataframe == "handwashing":
-        min_year = df_handwashing["Year"].min()
-        max_year = df_handwashing["Year"].max()
-    else:
-        min_year = df_open_defecation["Year"].min()
-        max_year = df_open_defecation["Year"].max()
+# Each dataframe is loaded through the shared columnar cache (see `columnar_cache.py`) the first time it is selected,
+# and dropped again when the loaded dataframes use more than DASH_DATASET_BUDGET_MB (see `DatasetRegistry`)
+datasets = DatasetRegistry()
+
+# The dataframe selected when the app opens
+DEFAULT_DATASET = "drinking"
+
+# First and last year of a dataframe, for the year slider
+def year_range(dataframe):
+    years = datasets[dataframe]["Year"]
+    return int(years.min()), int(years.max())
+
+def year_marks(min_year, max_year):
+    return {str(year): str(year) for year in range(min_year, max_year + 1)}
+
+min_year, max_year = year_range(DEFAULT_DATASET)
 
 # CSS styling
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
@@ -36,6 +31,24 @@ external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 app = Dash(__name__, external_stylesheets=external_stylesheets)
 server = app.server
 
+# Phase timing of the callbacks at /metrics when DASH_CALLBACK_METRICS=1, see `callback_metrics.py`
+instrument(app)
+
+# Compress the callback responses and keep them for repeated selections, see `compression.py`. The cached responses
+# are only valid for the versions of the source files the registry loaded its dataframes from
+compression = install_compression(app, version=datasets.versions)
+
+# Downloads of the four dataframes, streamed by the Flask server instead of going through a callback. They are
+# exported from the source files with all their columns and values, loaded by a registry of their own
+source_datasets = DatasetRegistry(read_csv_kwargs={})
+downloads = DatasetDownloads(app, source_datasets, {"drinking": "drinking", "sanitation": "sanitation",
+                                                    "handwashing": "handwashing", "open_defecation": "open_defecation"},
+                             version=source_datasets.versions)
+
+# Download link id -> dataframe
+download_links = {"download_drinking_dataframe": "drinking", "download_sanitation_dataframe": "sanitation",
+                  "download_handwashing_dataframe": "handwashing", "download_open_defecation_dataframe": "open_defecation"}
+
 # Layout for our data visualization application
 app.layout = html.Div(children=[
     # Title for the data visualization app showing a map of sanitation indicators worldwide by year and a graph for trend
@@ -61,8 +74,8 @@ app.layout = html.Div(children=[
         html.Div(className="six columns", children=[
         # The Dropdown to select the dataframes
             dcc.Dropdown(#options=['df_drinking', 'df_handwashing'],
-                options=dataframe_table["Dataframes"].unique(),
-                value='drinking',
+                options=list(datasets),
+                value=DEFAULT_DATASET,
                 id="dataframe_dropdown",
                 style={"width": "50%", "display": "inline-block"})
         ]),
@@ -87,10 +100,13 @@ app.layout = html.Div(children=[
     # The interactive plotly map
     dcc.Graph(id="sanitation_map", style={"padding": 20}),
 
+    # Values of every year for the selected dataframe and residence type, used to redraw the map in the browser
+    dcc.Store(id="map_values"),
+
     html.Br(),
 
     # Add slider for year
-    dcc.Slider(min=min_year, max=max_year, value=min_year, step=None, marks={str(year): str(year) for year in range(min_year, max_year + 1)},
+    dcc.Slider(min=min_year, max=max_year, value=min_year, step=None, marks=year_marks(min_year, max_year),
                included=False, id="year_slider"),
 
     # The Line graph
@@ -98,30 +114,45 @@ app.layout = html.Div(children=[
 
     html.Br(),
 
+    # Format of the downloads and whether they only contain the selected residence type and year
+    html.Div(className="row", children=[
+        dcc.Dropdown(
+            options=[{"label": DOWNLOAD_FORMAT_LABELS[fmt], "value": fmt} for fmt in FORMATS],
+            value="csv",
+            id="download_format",
+            clearable=False,
+            style={"width": "40%", "display": "inline-block"}
+        ),
+        dcc.Checklist(
+            options=[{"label": " Download only the selected residence type and year", "value": "selection"}],
+            value=[],
+            id="download_scope",
+            style={"display": "inline-block", "padding": 10}
+        )
+    ]),
+
+    html.Br(),
+
     # The button to download the respective dataframes
     html.Div(className="row", children=[
         # Download drinking dataframe
         html.Div([
-            html.Button("Download Drinking Dataframe CSV", id="drinking_csv"),
-            dcc.Download(id="download_drinking_dataframe")
+            html.A("Download Drinking Dataframe CSV", id="download_drinking_dataframe", className="button")
         ]),
         html.Br(),
         # Download sanitation dataframe
         html.Div([
-            html.Button("Download Sanitation Dataframe CSV", id="sanitation_csv"),
-            dcc.Download(id="download_sanitation_dataframe")
+            html.A("Download Sanitation Dataframe CSV", id="download_sanitation_dataframe", className="button")
         ]),
         html.Br(),
         # Download handwashing dataframe
         html.Div([
-            html.Button("Download Handwashing Dataframe CSV", id="handwashing_csv"),
-            dcc.Download(id="download_handwashing_dataframe")
+            html.A("Download Handwashing Dataframe CSV", id="download_handwashing_dataframe", className="button")
         ]),
         html.Br(),
         # Download open defecation dataframe
         html.Div([
-            html.Button("Download Open Defecation Dataframe CSV", id="open_defecation_csv"),
-            dcc.Download(id="download_open_defecation_dataframe")
+            html.A("Download Open Defecation Dataframe CSV", id="download_open_defecation_dataframe", className="button")
         ]),
     ], style={"display": "inline-block"})
 
@@ -137,26 +168,7 @@ def dropdown_output(value, residence_value):
     return f"You have chosen the {value} dataframe and the {residence_value} Residence Area Type option"
 
 # Draw a plotly map based on the dropdown value chosen
-@app.callback(
-    Output("sanitation_map", "figure"),
-    Input("dataframe_dropdown", "value"),
-    Input("year_slider", "value"),
-    Input("residence_area_type", "value")
-)
-def choropleth_map(dataframe_dropdown, year_slider, residence_area_type):
-    if dataframe_dropdown == "drinking":
-        df = df_drinking
-    elif dataframe_dropdown == "sanitation":
-        df = df_sanitation
-    elif dataframe_dropdown == "handwashing":
-        df = df_handwashing
-    else:
-        df = df_open_defecation
-
-    dff = df[df["Year"] == year_slider]
-    dff = dff[dff["Residence Area Type"] == residence_area_type]
-    dff = dff.sort_values(by="Year")
-
+def choropleth_figure(dff, year_slider):
     fig = px.choropleth(dff, locations="Country", locationmode="country names", color="Display Value", projection="orthographic",
                        hover_name="Country", scope="world", width=1000, custom_data="Country")
 
@@ -164,23 +176,103 @@ def choropleth_map(dataframe_dropdown, year_slider, residence_area_type):
 
     return fig
 
+# In the clientside mode (the default) the server only sends the values of every year for the selected dataframe and
+# residence type, once per dropdown change, and the browser redraws the map when the year slider moves. Set
+# SANITATION_MAP_CLIENTSIDE=0 to draw the map on the server on every slider move instead.
+CLIENTSIDE_SLIDER = os.environ.get("SANITATION_MAP_CLIENTSIDE", "1") != "0"
+
+if CLIENTSIDE_SLIDER:
+    # Values of every year for the selected dataframe and residence type, in a compact form: the country names once
+    # and one row of values (null where a country has no value) for each year
+    @app.callback(
+        Output("map_values", "data"),
+        Input("dataframe_dropdown", "value"),
+        Input("residence_area_type", "value")
+    )
+    def map_values(dataframe_dropdown, residence_area_type):
+        df = check_dropdown(dataframe_dropdown)
+        dff = df[df["Residence Area Type"] == residence_area_type]
+
+        # Some datasets have two indicators per country and year; the map shows the last one, as before
+        values = dff.pivot_table(index="Year", columns="Country", values="Display Value", aggfunc="last")
+        values = values.astype(object).where(values.notna(), None)
+
+        # The layout and the trace settings of the map, without the data of any year
+        base = choropleth_figure(dff.iloc[:0], "").to_plotly_json()
+        trace = {key: value for key, value in base["data"][0].items()
+                 if key not in ("locations", "z", "hovertext", "customdata")}
+
+        return {"countries": values.columns.tolist(), "years": values.index.tolist(), "z": values.values.tolist(),
+                "trace": trace, "layout": base["layout"], "title": "World Sanitation and Health by Country in"}
+
+    # Redraw the map in the browser from the stored values of the selected year
+    app.clientside_callback(
+        """
+        function(year, store) {
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            var row = store.z[store.years.indexOf(year)] || [];
+            var locations = [], z = [];
+            for (var i = 0; i < row.length; i++) {
+                if (row[i] !== null) {
+                    locations.push(store.countries[i]);
+                    z.push(row[i]);
+                }
+            }
+            var trace = Object.assign({}, store.trace, {
+                locations: locations,
+                z: z,
+                hovertext: locations,
+                customdata: locations.map(function (country) { return [country]; })
+            });
+            var layout = Object.assign({}, store.layout, {title: {text: store.title + " " + year}});
+            return {data: [trace], layout: layout};
+        }
+        """,
+        Output("sanitation_map", "figure"),
+        Input("year_slider", "value"),
+        Input("map_values", "data")
+    )
+else:
+    @app.callback(
+        Output("sanitation_map", "figure"),
+        Input("dataframe_dropdown", "value"),
+        Input("year_slider", "value"),
+        Input("residence_area_type", "value")
+    )
+    def choropleth_map(dataframe_dropdown, year_slider, residence_area_type):
+        df = check_dropdown(dataframe_dropdown)
+
+        dff = df[df["Year"] == year_slider]
+        dff = dff[dff["Residence Area Type"] == residence_area_type]
+        dff = dff.sort_values(by="Year")
+
+        return choropleth_figure(dff, year_slider)
+
 # Draw the drinking line graph
 ## First create the function that will automatically plot the map based on country name (from hover), the dataframe
 ## selected (from dropdown) and the residence type (from dropdown also). Thanks to Stack Overflow at
 # this link: https://stackoverflow.com/questions/76639315/make-the-line-graph-update-based-on-the-country-clicked-on-the-plotly-choropleth/76639830?noredirect=1#comment135126637_76639830
 
 # The below custom function matches the string selected in the dash dropdown to the correct dataframe
+# (a cleared dropdown falls back to the open defecation dataframe)
 def check_dropdown(dataframe_dropdown):
-    if dataframe_dropdown == "drinking":
-        df = df_drinking
-    elif dataframe_dropdown == "sanitation":
-        df = df_sanitation
-    elif dataframe_dropdown == "handwashing":
-        df = df_handwashing
-    else:
-        df = df_open_defecation
+    return datasets[dataframe_dropdown if dataframe_dropdown in datasets else "open_defecation"]
 
-    return df
+# Give the year slider the years of the selected dataframe, keeping the selected year when the dataframe has it
+@app.callback(
+    Output("year_slider", "min"),
+    Output("year_slider", "max"),
+    Output("year_slider", "marks"),
+    Output("year_slider", "value"),
+    Input("dataframe_dropdown", "value"),
+    State("year_slider", "value"),
+    prevent_initial_call=True
+)
+def update_year_slider(dataframe_dropdown, year):
+    min_year, max_year = year_range(dataframe_dropdown if dataframe_dropdown in datasets else "open_defecation")
+    return min_year, max_year, year_marks(min_year, max_year), min(max(year or min_year, min_year), max_year)
 
 # Now create the graph that updates the country name based on hover and showing Years on x-axis and Display value
 # of chosen dataframe on y-axis
@@ -211,41 +303,24 @@ def create_graph(clickData, dataframe_dropdown, residence_area_type):
 
     return fig
 
-# The function to download the drinking dataframe
-@app.callback(
-    Output("download_drinking_dataframe", "data"),
-    Input("drinking_csv", "n_clicks"),
-    prevent_initial_call=True
-)
-def download_dataframe(n_clicks):
-    return dcc.send_data_frame(df_drinking.to_csv, "drinking.csv")
-
-# The function to download the sanitation dataframe
+# Point the download buttons at the selected format and scope. The files themselves are served by `downloads`
 @app.callback(
-    Output("download_sanitation_dataframe", "data"),
-    Input("sanitation_csv", "n_clicks"),
-    prevent_initial_call=True
+    [Output(link_id, "href") for link_id in download_links],
+    Input("download_format", "value"),
+    Input("download_scope", "value"),
+    Input("residence_area_type", "value"),
+    Input("year_slider", "value")
 )
-def download_dataframe(n_clicks):
-    return dcc.send_data_frame(df_sanitation.to_csv, "sanitation.csv")
+def update_download_links(fmt, scope, residence_area_type, year):
+    selection = {"residence": residence_area_type, "year": year} if "selection" in (scope or []) else {}
+    return [downloads.url(name, fmt, **selection) for name in download_links.values()]
 
-# The function to download the handwashing dataframe
-@app.callback(
-    Output("download_handwashing_dataframe", "data"),
-    Input("handwashing_csv", "n_clicks"),
-    prevent_initial_call=True
-)
-def download_dataframe(n_clicks):
-    return dcc.send_data_frame(df_handwashing.to_csv, "handwashing.csv")
+# Render the default view and the most requested selections into the response cache at start, see `warmup.py`
+warmup = install_warmup(app, compression, "sanitation_map")
 
-# The function to download the open defecation dataframe
-@app.callback(
-    Output("download_open_defecation_dataframe", "data"),
-    Input("open_defecation_csv", "n_clicks"),
-    prevent_initial_call=True
-)
-def download_dataframe(n_clicks):
-    return dcc.send_data_frame(df_open_defecation.to_csv, "open_defecation.csv")
+# Build the CSV exports of the whole datasets along with the warm-up, so that the first downloads are served from memory
+if WARMUP_ENABLED:
+    downloads.prebuild()
 
 if __name__ == "__main__":
     app.run_server(debug=True)
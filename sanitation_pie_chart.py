@@ -1,13 +1,18 @@
 # Import the necessary python dash modules
 from dash import Dash, dcc, dash_table, html, Input, Output
 import plotly.express as px
-import pandas as pd
+from callback_metrics import instrument
+from census_etl import census_wide, load_census, table_columns
 
-df = pd.read_csv('sanitation_long2.csv')
-df2 = pd.read_csv('human_waste_filtered.csv')
+# The Kenya 2019 census table in long format with typed columns, converted by `census_etl.py`, and back in wide format
+df = load_census()
+df2 = census_wide(df)
 
 app = Dash(__name__)
 
+# Phase timing of the callbacks at /metrics when DASH_CALLBACK_METRICS=1, see `callback_metrics.py`
+instrument(app)
+
 app.layout = html.Div([
     html.H6("Pie chart showing human waste disposal as proportion of conventional households (Kenya 2019 census)"),
 
@@ -23,7 +28,7 @@ app.layout = html.Div([
 
     dcc.Graph(id='indicator-graphic'),
 
-    dash_table.DataTable(data=df2.to_dict('records'), page_size=5),
+    dash_table.DataTable(columns=table_columns(df2), data=df2.to_dict('records'), page_size=5),
 
     html.Div([
         html.Button("Download CSV", id="btn_csv"),
@@ -38,7 +43,7 @@ app.layout = html.Div([
 )
 def update_graph(selected_county):
     filtered_df = df[df.County == selected_county]
-    fig = px.pie(filtered_df, names='indicator', values='value')
+    fig = px.pie(filtered_df, names='indicator', values='percent', labels={'percent': 'value'})
     return fig
 
 @app.callback(
@@ -1,16 +1,19 @@
 # Import the necessary python dash modules
 from dash import Dash, dcc, dash_table, html, Input, Output
 import plotly.express as px
-import pandas as pd
+from callback_metrics import instrument
+from census_etl import census_wide, load_census, table_columns
 
-df = pd.read_csv('sanitation_long2.csv')
-df2 = pd.read_csv('human_waste_filtered.csv')
-df2 = df2[['County', 'Conventional Households', 'Main Sewer', 'Septic tank', 'Cess pool', 'VIP Latrine',
-           'Pit latrine covered', 'Pit Latrine uncovered', 'Bucket latrine', 'Open/ Bush', 'Bio-septic tank/ Biodigester', 'Not Stated']]
+# The Kenya 2019 census table in long format with typed columns, converted by `census_etl.py`, and back in wide format
+df = load_census()
+df2 = census_wide(df)
 
 app = Dash(__name__)
 server = app.server
 
+# Phase timing of the callbacks at /metrics when DASH_CALLBACK_METRICS=1, see `callback_metrics.py`
+instrument(app)
+
 app.layout = html.Div([
     html.H6("Pie chart showing human waste disposal as proportion of conventional households (Kenya 2019 census)"),
 
@@ -26,21 +29,7 @@ app.layout = html.Div([
 
     dcc.Graph(id='indicator-graphic'),
 
-    dash_table.DataTable(columns= [
-        {'name': i, 'id': i} for i in df2.columns
-        # {'name': 'County', 'id': 'County', 'type': 'text'},
-        # {'name': 'Conventional Households', 'id': 'Conventional Households', 'type': 'text'},
-        # {'name': 'Main Sewer', 'id': 'Main Sewer', 'type': 'numeric'},
-        # {'name': 'Septic tank', 'id': 'Septic tank', 'type': 'numeric'},
-        # {'name': 'Cess pool', 'id': 'Cess pool', 'type': 'numeric'},
-        # {'name': 'VIP Latrine', 'id': 'VIP Latrine', 'type': 'numeric'},
-        # {'name': 'Pit latrine covered', 'id': 'Pit latrine covered', 'type': 'numeric'},
-        # {'name': 'Pit Latrine uncovered', 'id': 'Pit Latrine uncovered', 'type': 'numeric'},
-        # {'name': 'Bucket latrine', 'id': 'Bucket latrine', 'type': 'numeric'},
-        # {'name': 'Open/ Bush', 'id': 'Open/ Bush', 'type': 'numeric'},
-        # {'name': 'Bio-septic tank/ Biodigester', 'id': 'Bio-septic tank/ Biodigester', 'type': 'numeric'},
-        # {'name': 'Not Stated', 'id': 'Not Stated', 'type': 'numeric'}
-],
+    dash_table.DataTable(columns=table_columns(df2),
         data=df2.to_dict('records'),
         filter_action='native',
         sort_action='native',
@@ -60,7 +49,7 @@ app.layout = html.Div([
 )
 def update_graph(selected_county):
     filtered_df = df[df.County == selected_county]
-    fig = px.pie(filtered_df, names='indicator', values='value')
+    fig = px.pie(filtered_df, names='indicator', values='percent', labels={'percent': 'value'})
     fig.update_layout(transition_duration=40)
     return fig
 
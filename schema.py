@@ -0,0 +1,98 @@
+# Declarative schemas of the dataframes the dashboards keep in memory.
+#
+# A schema lists the columns that are used (anything else in the source file is not loaded) with a compact type for
+# each: "category" for repeated strings such as country names, small integers for years and float32 for percentages
+# and other measures. Applied through `read_csv`, the typed frame is what the columnar cache stores, so loading it
+# again costs nothing extra.
+#
+# float32 keeps about 7 significant digits, which holds every measure of the source files, but a float32 value read
+# back as a float64 is not the number of the file: 0.3 becomes 0.30000001192092896 in a table, a hover or a download.
+# The loaders therefore widen the float32 columns with `Schema.widen` (see `decimal_float64`) before the frames reach
+# a figure or the browser; only those few columns take float64 memory, and they are private to each process.
+#
+# `python schema.py` prints the memory of every frame loaded as before and with its schema.
+import numpy as np
+import pandas as pd
+
+
+class Schema:
+    # `columns`: source column -> dtype, in the order of the frame. `rename`: source column -> shorter name
+    def __init__(self, columns, rename=None):
+        self.columns = dict(columns)
+        self.rename = dict(rename or {})
+
+    # Keyword arguments for `pd.read_csv` / `cached_read_csv` that load the columns with their types
+    def read_csv_kwargs(self):
+        return {"usecols": list(self.columns), "dtype": self.columns}
+
+    # Convert a frame that was loaded with every column as it is
+    def apply(self, df):
+        return df[list(self.columns)].astype(self.columns).rename(columns=self.rename)
+
+    # The float32 columns of a frame as float64 numbers, see `decimal_float64`
+    @staticmethod
+    def widen(df):
+        narrow = [column for column, values in df.items() if values.dtype == np.float32]
+        return df.assign(**{column: decimal_float64(df[column].to_numpy()) for column in narrow}) if narrow else df
+
+    def load_csv(self, path, **kwargs):
+        return self.widen(pd.read_csv(path, **self.read_csv_kwargs(), **kwargs).rename(columns=self.rename))
+
+
+# float32 values as the float64 numbers of their shortest decimal text: 0.3 rather than 0.30000001192092896. Other
+# arrays are returned as they are. Each distinct value is converted once, measures repeat a lot
+def decimal_float64(values):
+    values = np.asarray(values)
+    if values.dtype != np.float32:
+        return values
+    uniques, inverse = np.unique(values, return_inverse=True)
+    return np.asarray(uniques.astype(str), dtype=np.float64)[inverse.reshape(values.shape)]
+
+
+# The WHO sanitation datasets. `PUBLISH STATES` has a single value, and `Low`, `High` and `Comments` are empty. The
+# downloads of the dashboards still have them, they are exported from the source files (see `downloads.py`).
+# `Display Value` has missing values in the drinking water dataset, hence float32 rather than uint8
+WHO_SCHEMA = Schema({
+    "Indicator": "category",
+    "Year": "int16",
+    "WHO region": "category",
+    "Country": "category",
+    "Residence Area Type": "category",
+    "Display Value": "float32",
+    "Numeric": "float32",
+})
+
+# The cleaned Our World in Data diarrhoea dataset, with short names for the measures. Rows without deaths or
+# population are removed by the cleaning, so the population fits an unsigned integer
+DIARRHOEA_SCHEMA = Schema({
+    "Entity": "category",
+    "Code": "category",
+    "Year": "int16",
+    "Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)": "float32",
+    "GDP per capita, PPP (constant 2017 international $)": "float32",
+    "Population (historical estimates)": "uint32",
+    "sub-region": "category",
+}, rename={
+    "Deaths - Diarrheal diseases - Sex: Both - Age: Under 5 (Rate)": "Deaths",
+    "GDP per capita, PPP (constant 2017 international $)": "GDP per capita",
+    "Population (historical estimates)": "Population",
+})
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+if __name__ == "__main__":
+    from diarrhoea_etl import REGIONS_CSV, SOURCE_CSV, clean, load_cleaned
+    from sanitation_data import WHO_DATASETS
+
+    rows = []
+    for name, path in WHO_DATASETS.items():
+        rows.append((name, frame_bytes(pd.read_csv(path)), frame_bytes(WHO_SCHEMA.load_csv(path))))
+    rows.append(("diarrhoea", frame_bytes(clean(pd.read_csv(SOURCE_CSV), pd.read_csv(REGIONS_CSV))),
+                 frame_bytes(load_cleaned())))
+
+    print(f"{'frame':<18}{'before (KB)':>14}{'after (KB)':>14}{'ratio':>9}")
+    for name, before, after in rows + [("total", sum(row[1] for row in rows), sum(row[2] for row in rows))]:
+        print(f"{name:<18}{before / 1024:>14.1f}{after / 1024:>14.1f}{before / after:>8.1f}x")
@@ -1,17 +1,20 @@
 # Import the necessary packages
-import pandas as pd
 import plotly.express as px
 from dash import Dash, dash_table, dcc, html, Input, Output
+from callback_metrics import instrument
+from census_etl import census_wide, load_census, table_columns
 
-df = pd.read_csv('sanitation_long2.csv')
-df2 = pd.read_csv('human_waste_filtered.csv')
-df2 = df2[['County', 'Conventional Households', 'Main Sewer', 'Septic tank', 'Cess pool', 'VIP Latrine',
-           'Pit latrine covered', 'Pit Latrine uncovered', 'Bucket latrine', 'Open/ Bush', 'Bio-septic tank/ Biodigester', 'Not Stated']]
+# The Kenya 2019 census table in long format with typed columns, converted by `census_etl.py`, and back in wide format
+df = load_census()
+df2 = census_wide(df)
 
 # Initialize the app
 app = Dash(__name__)
 server = app.server
 
+# Phase timing of the callbacks at /metrics when DASH_CALLBACK_METRICS=1, see `callback_metrics.py`
+instrument(app)
+
 # App layout
 app.layout = html.Div([
     html.H2(children="Chart showing human waste disposal as proportion of conventional households (Kenya 2019 census)"),
@@ -23,9 +26,7 @@ app.layout = html.Div([
     dcc.Graph(figure={}, id='controls-and-graph'),
 
     # Create filterable datatable
-    dash_table.DataTable(columns=[
-        {'name': i, 'id': i} for i in df2.columns
-    ],
+    dash_table.DataTable(columns=table_columns(df2),
         data=df2.to_dict('records'),
         filter_action='native',
         sort_action='native',
@@ -49,7 +50,7 @@ def update_graph(dropdown_choices):
     else:
         dff = df[df.County.isin(dropdown_choices)]
         # melted_df = dff.melt(id_vars='County', var_name='indicator', value_name='value')
-        fig = px.bar(dff, x='County', y='value', color='indicator', barmode='stack')
+        fig = px.bar(dff, x='County', y='percent', color='indicator', labels={'percent': 'value'}, barmode='stack')
         # Increase the rendering speed
         fig.update_layout(transition_duration=100)
         return fig
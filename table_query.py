@@ -0,0 +1,152 @@
+# Server-side filtering, sorting and paging for `dash_table.DataTable` with
+# `page_action='custom'`, `filter_action='custom'` and `sort_action='custom'`.
+#
+# The table sends its `filter_query` (e.g. `{Country} = Kenya && {Year} >= 2010`), `sort_by` and page number. The
+# query is translated into numpy operations on precomputed column arrays and the result (the ordered row positions)
+# is cached, so that flipping through the pages of a result only slices it.
+import re
+
+import numpy as np
+import pandas as pd
+
+from trace_cache import LRUCache
+
+# Dash filter operators, without their case-sensitivity prefix ("s" or "i")
+OPERATORS = {
+    "=": "eq", "eq": "eq", "!=": "ne", "ne": "ne",
+    "<": "lt", "lt": "lt", "<=": "le", "le": "le", ">": "gt", "gt": "gt", ">=": "ge", "ge": "ge",
+    "contains": "contains", "datestartswith": "startswith",
+}
+
+FILTER_PART = re.compile(r"^\{(?P<column>[^}]+)\}\s*(?P<operator>[si]?[<>!=]=?|[a-z]+)\s*(?P<value>.*)$")
+
+
+# Split a filter query into (column, operator, value, case insensitive) tuples. The table sends the "i" operators,
+# e.g. `icontains` or `i=`, when the filter is set to ignore case
+def parse_filter(filter_query):
+    parts = []
+    for part in filter(None, (part.strip() for part in (filter_query or "").split(" && "))):
+        match = FILTER_PART.match(part)
+        if not match:
+            raise ValueError(f"Unsupported filter: {part}")
+        operator, insensitive = match["operator"], False
+        if operator not in OPERATORS and operator[:1] in "si" and operator[1:] in OPERATORS:
+            operator, insensitive = operator[1:], operator[0] == "i"
+        if operator not in OPERATORS:
+            raise ValueError(f"Unsupported filter operator: {match['operator']}")
+
+        value = match["value"].strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'`":
+            value = value[1:-1]
+        parts.append((match["column"], OPERATORS[operator], value, insensitive))
+    return parts
+
+
+# Lower-cased text, for the case insensitive operators
+def fold(values):
+    return np.char.lower(values) if isinstance(values, np.ndarray) else values.lower()
+
+
+class TableQuery:
+    def __init__(self, df, index_columns=(), cache_size=256):
+        self.frame = df.reset_index(drop=True)
+        self.arrays = {column: self.frame[column].to_numpy() for column in self.frame.columns}
+
+        # Text columns as codes into their unique values: string filters are evaluated on the few unique values and
+        # mapped back to the rows through the codes
+        self.text = {}
+        for column, values in self.frame.items():
+            if values.dtype.kind not in "biuf":
+                codes, uniques = pd.factorize(values.astype(object).fillna(""))
+                self.text[column] = (codes, np.asarray(uniques, dtype=str))
+
+        # Rank of every row for every column, so a multi-column sort is one np.lexsort over small integer arrays
+        self.ranks = {column: pd.Series(values).rank(method="dense", na_option="bottom").to_numpy(np.int32)
+                      for column, values in self.arrays.items()}
+
+        # Row positions of every value of the indexed columns, for equality filters that do not need a scan
+        self.indexes = {column: {value: np.asarray(positions, dtype=np.intp)
+                                 for value, positions in self.frame.groupby(column, sort=False).indices.items()}
+                        for column in index_columns}
+        # The same with the text values lower-cased, for case insensitive equality
+        self.folded_indexes = {}
+        for column, index in self.indexes.items():
+            folded = {}
+            for value, positions in index.items():
+                folded.setdefault(fold(value) if isinstance(value, str) else value, []).append(positions)
+            self.folded_indexes[column] = {value: np.sort(np.concatenate(positions))
+                                           for value, positions in folded.items()}
+
+        self.cache = LRUCache(cache_size)
+
+    def _mask(self, column, operator, value, positions, insensitive=False):
+        if column in self.text:
+            codes, uniques = self.text[column]
+            if insensitive:
+                uniques, value = fold(uniques), fold(value)
+            if operator == "contains":
+                matches = np.char.find(uniques, value) >= 0
+            elif operator == "startswith":
+                matches = np.char.startswith(uniques, value)
+            else:
+                matches = self._compare(operator, uniques, value)
+            return matches[codes[positions]]
+
+        values = self.arrays[column][positions]
+        if operator in ("contains", "startswith"):
+            values = values.astype(str)
+            if insensitive:
+                values, value = fold(values), fold(value)
+            if operator == "contains":
+                return np.char.find(values, value) >= 0
+            return np.char.startswith(values, value)
+        try:
+            value = float(value)
+        except ValueError:
+            return np.zeros(len(positions), dtype=bool)
+        return self._compare(operator, values, value)
+
+    @staticmethod
+    def _compare(operator, values, value):
+        return {"eq": np.equal, "ne": np.not_equal, "lt": np.less, "le": np.less_equal,
+                "gt": np.greater, "ge": np.greater_equal}[operator](values, value)
+
+    # Positions of the rows matching the filter query, in the order given by `sort_by`
+    def _run(self, filter_query, sort_by):
+        positions = None
+        remaining = []
+        for column, operator, value, insensitive in parse_filter(filter_query):
+            if column not in self.arrays:
+                raise ValueError(f"Unknown column: {column}")
+            if operator == "eq" and column in self.indexes:
+                # Index-backed equality: intersect with the rows of that value instead of scanning the column
+                if insensitive:
+                    matches = self.folded_indexes[column].get(fold(value), np.empty(0, dtype=np.intp))
+                else:
+                    matches = self.indexes[column].get(value, np.empty(0, dtype=np.intp))
+                positions = matches if positions is None else np.intersect1d(positions, matches)
+            else:
+                remaining.append((column, operator, value, insensitive))
+
+        if positions is None:
+            positions = np.arange(len(self.frame))
+        for column, operator, value, insensitive in remaining:
+            positions = positions[self._mask(column, operator, value, positions, insensitive)]
+
+        if sort_by:
+            # np.lexsort sorts by the last key first
+            keys = [self.ranks[sort["column_id"]][positions] * (1 if sort["direction"] == "asc" else -1)
+                    for sort in reversed(sort_by)]
+            positions = positions[np.lexsort(keys)]
+        return positions
+
+    def positions(self, filter_query, sort_by):
+        key = (filter_query or "", tuple((sort["column_id"], sort["direction"]) for sort in sort_by or []))
+        return self.cache.get_or_build(key, lambda: self._run(filter_query, sort_by))
+
+    # (records of one page, number of pages)
+    def page(self, page_current, page_size, filter_query=None, sort_by=None):
+        positions = self.positions(filter_query, sort_by)
+        start = (page_current or 0) * page_size
+        records = self.frame.iloc[positions[start:start + page_size]].to_dict("records")
+        return records, max(1, -(-len(positions) // page_size))
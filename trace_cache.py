@@ -0,0 +1,59 @@
+# Small bounded LRU cache used to keep figure pieces (single traces) between callback calls.
+#
+# Whole figures are a poor cache key for the multi-select dropdowns: almost every selection is a new combination of
+# countries. A trace for one country does not depend on the other countries that are selected, so caching traces and
+# assembling the figure from them means a new selection only builds the traces that were never built before.
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = int(os.environ.get("DASH_TRACE_CACHE_SIZE", 2048))
+
+
+class LRUCache:
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    # Return the cached value for `key`, calling `build()` to create it on a miss
+    def get_or_build(self, key, build):
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key]
+            self.misses += 1
+        # Build outside the lock so that a slow build does not block other threads reading the cache
+        value = build()
+        self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        return {"size": len(self._items), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
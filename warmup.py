@@ -0,0 +1,205 @@
+# Warm-up of the response cache of `compression.py` when an app starts.
+#
+# The first visitor after a deploy otherwise waits for every figure of the page to be built. With DASH_WARMUP=1 (set
+# by `gunicorn.conf.py`), `install_warmup(app, compression, name)` at the end of an app module renders, before the
+# app serves anything:
+#
+# - the default view: every callback that runs when the page loads, with the values of the layout
+# - the most requested selections of earlier runs, rendered in a pool of forked processes
+#
+# With gunicorn's preload the warm-up runs once in the master and its cache is shared by the workers.
+#
+# To know the most requested selections, every callback request answered with a figure is counted and the counts are
+# appended to `.cache/warmup/<name>.jsonl` from time to time. Only the callback, its input and state values and the
+# triggering props are kept: no address, header, cookie or time of the request. Set DASH_WARMUP_LOG=0 to log nothing.
+import atexit
+import json
+import multiprocessing
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import request
+from plotly.io.json import to_json_plotly
+
+WARMUP_DIR = os.environ.get("DASH_WARMUP_DIR", os.path.join(".cache", "warmup"))
+ENABLED = os.environ.get("DASH_WARMUP", "0") == "1"
+LOG_ENABLED = os.environ.get("DASH_WARMUP_LOG", "1") == "1"
+
+# Number of recorded selections rendered at start, and processes rendering them
+TOP_N = int(os.environ.get("DASH_WARMUP_TOP", 50))
+PROCESSES = int(os.environ.get("DASH_WARMUP_PROCESSES", min(4, os.cpu_count() or 1)))
+
+# Counted requests kept in memory before they are appended to the log
+FLUSH_EVERY = 50
+
+# The log is rewritten with one line per selection when it grows past this many lines
+COMPACT_LINES = 20000
+
+# The parts of a callback request that decide its response, the same as the cache key of `compression.py`
+FIELDS = ("output", "inputs", "state", "changedPropIds")
+
+# App being rendered by the processes of the pool, set before they are forked
+_rendering = None
+
+
+def _canonical(payload):
+    return json.dumps({field: payload[field] for field in FIELDS if field in payload}, sort_keys=True,
+                      separators=(",", ":"))
+
+
+# The request the browser sends for `argument` ({"id", "property"}): a prop missing from the layout has no value
+def _argument_value(components, argument):
+    props = components[argument["id"]].to_plotly_json()["props"] if argument["id"] in components else {}
+    if argument["property"] in props:
+        # As the browser gets it, e.g. numpy numbers become plain numbers
+        return dict(argument, value=json.loads(to_json_plotly(props[argument["property"]])))
+    return dict(argument)
+
+
+# Requests of the callbacks that run when the page is loaded
+def default_requests(app):
+    components = {component.id: component for component in app.layout._traverse()
+                  if getattr(component, "id", None) is not None}
+    initial = {callback["output"] for callback in app._callback_list
+               if not callback.get("prevent_initial_call") and not callback.get("clientside_function")}
+    # Inputs that are outputs of another callback only get their value once that callback answered
+    outputs = {output for key in app.callback_map for output in key.strip(".").split("...")}
+
+    requests = []
+    for key, callback in app.callback_map.items():
+        if key not in initial or "callback" not in callback:
+            continue
+        if any(f"{argument['id']}.{argument['property']}" in outputs for argument in callback["inputs"]):
+            continue
+        payload = {"output": key,
+                   "inputs": [_argument_value(components, argument) for argument in callback["inputs"]],
+                   "changedPropIds": []}
+        if callback["state"]:
+            payload["state"] = [_argument_value(components, argument) for argument in callback["state"]]
+        requests.append(payload)
+    return requests
+
+
+def _post(client, prefix, payload):
+    outputs = [dict(zip(("id", "property"), output.rsplit(".", 1)))
+               for output in payload["output"].strip(".").split("...")]
+    body = dict(payload, outputs=outputs if payload["output"].startswith("..") else outputs[0])
+    return client.post(f"{prefix}_dash-update-component", json=body, headers={"Accept-Encoding": "gzip"})
+
+
+# Runs in a process of the pool: render the requests and return the entries they left in the response cache
+def _render(payloads):
+    client = _rendering.app.server.test_client()
+    entries = []
+    for payload in payloads:
+        if _post(client, _rendering.prefix, payload).status_code == 200:
+            key = _rendering.compression.callback_key(json.dumps(payload).encode())[0]
+            entry = _rendering.compression.cache.get(key)
+            if entry is not None:
+                entries.append((key, entry))
+    return entries
+
+
+class CacheWarmup:
+    def __init__(self, app, compression, name, log_dir=WARMUP_DIR):
+        self.app = app
+        self.compression = compression
+        self.prefix = app.config.routes_pathname_prefix
+        self.path = os.path.join(log_dir, f"{name}.jsonl")
+        self.counts = Counter()
+        self.recording = True
+        self._lock = threading.Lock()
+
+    # Flask `after_request` hook, so that requests answered from the response cache are counted too
+    def record(self, response):
+        if (self.recording and response.status_code == 200 and request.method == "POST"
+                and request.path == f"{self.prefix}_dash-update-component"):
+            payload = json.loads(request.get_data())
+            if payload.get("output") not in self.compression.uncached:
+                with self._lock:
+                    self.counts[_canonical(payload)] += 1
+                    full = sum(self.counts.values()) >= FLUSH_EVERY
+                if full:
+                    self.flush()
+        return response
+
+    def flush(self):
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        if not counts:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        lines = "".join(json.dumps({"request": json.loads(request_), "count": count}) + "\n"
+                        for request_, count in counts.items())
+        # A single write in append mode, so that the lines of several workers do not interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, lines.encode())
+        finally:
+            os.close(fd)
+
+    def recorded(self):
+        counts = Counter()
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except OSError:
+            return counts
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash
+                continue
+            counts[_canonical(entry["request"])] += entry["count"]
+        if len(lines) > COMPACT_LINES:
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.writelines(json.dumps({"request": json.loads(request_), "count": count}) + "\n"
+                             for request_, count in counts.items())
+            os.replace(tmp, self.path)
+        return counts
+
+    # Render the default view, then the `top_n` most requested selections. Returns the number of cached responses
+    def run(self, top_n=TOP_N, processes=PROCESSES):
+        global _rendering
+        _rendering = self
+        # The warm-up requests are not selections of users
+        self.recording = False
+        try:
+            client = self.app.server.test_client()
+            defaults = default_requests(self.app)
+            for payload in defaults:
+                _post(client, self.prefix, payload)
+
+            default_keys = {_canonical(payload) for payload in defaults}
+            slots = max(min(top_n, self.compression.cache.maxsize - len(defaults)), 0)
+            hottest = [json.loads(request_) for request_, _ in self.recorded().most_common()
+                       if request_ not in default_keys][:slots]
+            if processes > 1 and len(hottest) > 1 and "fork" in multiprocessing.get_all_start_methods():
+                with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("fork")) as pool:
+                    entries = dict(entry for chunk in pool.map(_render, [hottest[i::processes]
+                                                                         for i in range(processes)])
+                                   for entry in chunk)
+                # Least requested first, so that the hottest selections are the most recent ones of the LRU cache
+                for payload in hottest[::-1]:
+                    key = self.compression.callback_key(json.dumps(payload).encode())[0]
+                    if key in entries:
+                        self.compression.cache.put(key, entries[key])
+            else:
+                _render(hottest[::-1])
+        finally:
+            self.recording = True
+        return len(self.compression.cache)
+
+
+def install_warmup(app, compression, name, log_dir=WARMUP_DIR):
+    warmup = CacheWarmup(app, compression, name, log_dir=log_dir)
+    if LOG_ENABLED:
+        app.server.after_request(warmup.record)
+        atexit.register(warmup.flush)
+    if ENABLED:
+        warmup.run()
+    return warmup
@@ -0,0 +1,125 @@
+# Import the necessary packages
+import numpy as np
+import plotly.graph_objects as go
+from dash import Dash, dcc, html, Input, Output
+from sanitation_data import AlignedIndicators, load_who_datasets
+from compression import install_compression
+from callback_metrics import instrument, phase
+
+# The sanitation dataframes from Kaggle: https://www.kaggle.com/datasets/navinmundhra/world-sanitation, joined once on
+# (Country, Residence Area Type, Year) with the correlations of every pair of indicators, see `AlignedIndicators`
+indicators = AlignedIndicators(load_who_datasets())
+
+# Shorter names of the indicators for the axes of the correlation matrix, e.g. "practising open defecation"
+SHORT_NAMES = {indicator: indicator.removeprefix("Population ").removesuffix(" (%)")
+               for indicator in indicators.indicators}
+INDICATORS = {short_name: indicator for indicator, short_name in SHORT_NAMES.items()}
+
+app = Dash(__name__)
+server = app.server
+
+# Phase timing of the callbacks at /metrics when DASH_CALLBACK_METRICS=1, see `callback_metrics.py`
+instrument(app)
+
+# Compress the callback responses and keep them for repeated selections, see `compression.py`
+compression = install_compression(app)
+
+app.layout = html.Div([
+    html.H2("Comparison of the WHO sanitation indicators"),
+
+    dcc.Markdown('''
+    Each point is a country. Click a cell of the correlation matrix to compare its two indicators.
+    '''),
+
+    # The indicators of the two axes
+    html.Div([
+        dcc.Dropdown(indicators.indicators, 'Population using at least basic drinking-water services (%)',
+                     id='comparison-x', clearable=False),
+    ], style={'width': '48%', 'display': 'inline-block'}),
+    html.Div([
+        dcc.Dropdown(indicators.indicators, 'Population practising open defecation (%)', id='comparison-y',
+                     clearable=False),
+    ], style={'width': '48%', 'float': 'right', 'display': 'inline-block'}),
+
+    dcc.RadioItems(indicators.residences, 'Total', id='comparison-residence', inline=True),
+
+    # The year, or all the years at once
+    dcc.Checklist({'all': 'All years'}, [], id='comparison-all-years', inline=True),
+    dcc.Slider(min(indicators.years), max(indicators.years), step=None, value=max(indicators.years),
+               marks={str(year): str(year) for year in indicators.years}, id='comparison-year'),
+
+    html.Div([
+        dcc.Graph(id='comparison-scatter', style={'width': '50%', 'display': 'inline-block'}),
+        dcc.Graph(id='comparison-correlations', style={'width': '50%', 'display': 'inline-block'}),
+    ]),
+])
+
+
+# The two indicators of the clicked cell of the correlation matrix
+@app.callback(
+    Output('comparison-x', 'value'),
+    Output('comparison-y', 'value'),
+    Input('comparison-correlations', 'clickData'),
+    prevent_initial_call=True
+)
+def select_pair(clickData):
+    point = clickData['points'][0]
+    return INDICATORS[point['x']], INDICATORS[point['y']]
+
+
+# The countries of the selected residence area type and year, one indicator against the other
+@app.callback(
+    Output('comparison-scatter', 'figure'),
+    Input('comparison-x', 'value'),
+    Input('comparison-y', 'value'),
+    Input('comparison-residence', 'value'),
+    Input('comparison-year', 'value'),
+    Input('comparison-all-years', 'value')
+)
+def update_scatter(x_indicator, y_indicator, residence, year, all_years):
+    year = None if 'all' in (all_years or []) else year
+    countries, x, y = indicators.pair(x_indicator, y_indicator, residence, year)
+
+    x_position, y_position = indicators.indicators.index(x_indicator), indicators.indicators.index(y_indicator)
+    correlation = indicators.correlations[residence, year][x_position, y_position]
+    pairs = indicators.pair_counts[residence, year][x_position, y_position]
+
+    with phase('figure'):
+        fig = go.Figure(go.Scatter(x=x, y=y, text=countries, mode='markers', marker={'size': 8, 'opacity': 0.7},
+                                   hovertemplate='<b>%{text}</b><br>x: %{x}<br>y: %{y}<extra></extra>'))
+        fig.update_layout(
+            title={'text': f"{residence}, {year or 'all years'}: "
+                           f"r = {'n/a' if np.isnan(correlation) else f'{correlation:.2f}'} over {pairs} values"},
+            xaxis={'title': {'text': x_indicator}, 'range': [-2, 102]},
+            yaxis={'title': {'text': y_indicator}, 'range': [-2, 102]},
+            margin={'l': 40, 'b': 40, 't': 60, 'r': 10},
+        )
+
+    return fig
+
+
+# The correlation of every pair of indicators in the selected residence area type and year
+@app.callback(
+    Output('comparison-correlations', 'figure'),
+    Input('comparison-residence', 'value'),
+    Input('comparison-year', 'value'),
+    Input('comparison-all-years', 'value')
+)
+def update_correlations(residence, year, all_years):
+    year = None if 'all' in (all_years or []) else year
+    correlations = indicators.correlations[residence, year]
+    names = [SHORT_NAMES[indicator] for indicator in indicators.indicators]
+
+    with phase('figure'):
+        fig = go.Figure(go.Heatmap(
+            z=correlations, x=names, y=names, zmin=-1, zmax=1, colorscale='RdBu',
+            text=np.where(np.isnan(correlations), '', np.round(correlations, 2).astype(str)), texttemplate='%{text}',
+            customdata=indicators.pair_counts[residence, year],
+            hovertemplate='%{y}<br>%{x}<br>r = %{z:.2f} over %{customdata} values<extra></extra>'))
+        fig.update_layout(title={'text': f"Correlations, {residence}, {year or 'all years'}"},
+                          yaxis={'autorange': 'reversed'}, margin={'l': 40, 'b': 40, 't': 60, 'r': 10})
+
+    return fig
+
+if __name__ == '__main__':
+    app.run_server(debug=True)
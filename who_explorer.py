@@ -0,0 +1,74 @@
+# Import the necessary packages
+from dash import Dash, dash_table, dcc, html, Input, Output
+from sanitation_data import load_who_datasets
+from table_query import TableQuery
+from callback_metrics import instrument
+
+# The sanitation dataframes from Kaggle: https://www.kaggle.com/datasets/navinmundhra/world-sanitation
+datasets = load_who_datasets()
+
+# Query engine of each dataset. Equality filters on `Country` and `Residence Area Type` are answered from an index
+queries = {name: TableQuery(df, index_columns=['Country', 'Residence Area Type']) for name, df in datasets.items()}
+
+PAGE_SIZE = 20
+
+app = Dash(__name__)
+server = app.server
+
+# Phase timing of the callbacks at /metrics when DASH_CALLBACK_METRICS=1, see `callback_metrics.py`
+instrument(app)
+
+app.layout = html.Div([
+    html.H2("Explorer for the raw WHO sanitation datasets"),
+
+    dcc.Markdown('''
+    Filter with the row under the column names, e.g. `Kenya` under *Country* or `>= 2010` under *Year*.
+    Only the rows of the current page are sent to the browser.
+    '''),
+
+    # Dropdown to select the dataset
+    dcc.Dropdown(options=list(datasets), value='drinking', id='explorer-dataset', clearable=False,
+                 style={'width': '50%'}),
+
+    html.Br(),
+
+    # The table is filtered, sorted and paged on the server
+    dash_table.DataTable(
+        id='explorer-table',
+        columns=[{'name': column, 'id': column,
+                  'type': 'numeric' if datasets['drinking'][column].dtype.kind in 'biuf' else 'text'}
+                 for column in datasets['drinking'].columns],
+        page_current=0,
+        page_size=PAGE_SIZE,
+        page_action='custom',
+        filter_action='custom',
+        filter_query='',
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[],
+    ),
+
+    html.Div(id='explorer-message'),
+])
+
+# Send the rows of the current page only
+@app.callback(
+    Output('explorer-table', 'data'),
+    Output('explorer-table', 'page_count'),
+    Output('explorer-message', 'children'),
+    Input('explorer-dataset', 'value'),
+    Input('explorer-table', 'page_current'),
+    Input('explorer-table', 'page_size'),
+    Input('explorer-table', 'sort_by'),
+    Input('explorer-table', 'filter_query'),
+)
+def update_table(dataset, page_current, page_size, sort_by, filter_query):
+    try:
+        records, page_count = queries[dataset].page(page_current, page_size, filter_query, sort_by)
+    except ValueError as error:
+        return [], 1, str(error)
+
+    return records, page_count, ""
+
+if __name__ == '__main__':
+    app.run_server(debug=True)